@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+插件查找、重载及执行性能测试
+在临时目录中生成指定数量、嵌套深度、文件大小和签名形式的插件，分别测试：
+    1. discovery: findPlugins（冷启动、无变化）及md5Sum耗时
+    2. reload: loadPlugins全量导入、无变化重载、部分插件变化后的增量重载
+    3. binding: 绑定器生成及callFunc单次调用耗时
+    4. process: process()单周期耗时的p50/p99及吞吐量
+    5. server: 常驻任务服务通过Unix domain socket端到端执行任务的吞吐量（jobs/s）及单任务延迟
+    6. soak: 反复修改部分插件并重载后的常驻内存（RSS）增长、sys.modules增长及尚未释放的插件模块代数
+结果以json输出，可通过--compare与之前的结果对比
+
+使用示例：
+    python benchmark.py --plugins 1000 --depth 3 --output before.json
+    python benchmark.py --plugins 1000 --depth 3 --compare before.json
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from plugin import loader, middleware, modules, server
+from plugin.metrics import timer
+
+SIGNATURES = {
+    "none": "def run():\n    return True\n",
+    "args": "def run(a, b):\n    return True\n",
+    "defaults": "def run(a, b=1, c=None):\n    return True\n",
+}
+
+
+# 生成插件目录，插件平均分布在各层子目录中
+def makeTree(root, count, depth, size, signature, prefix):
+    shapes = sorted(SIGNATURES) if signature == "mixed" else [signature]
+    dirs = [root]
+    for level in range(depth):
+        dirs.append(os.path.join(dirs[-1], "d%s" % level))
+        os.mkdir(dirs[-1])
+    paths = []
+    for i in range(count):
+        body = SIGNATURES[shapes[i % len(shapes)]]
+        body += "#" * max(size - len(body) - 1, 0) + "\n"
+        path = os.path.join(dirs[i % len(dirs)], "%s_%06d.py" % (prefix, i))
+        with open(path, "w") as fd:
+            fd.write(body)
+        paths.append(path)
+    return paths
+
+
+# 修改插件文件内容，保证stat指纹变化
+def touch(paths):
+    for path in paths:
+        with open(path, "a") as fd:
+            fd.write("#\n")
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+
+# 计算耗时，返回(耗时, 返回值)
+def measure(method, *args, **kwargs):
+    start = timer()
+    rst = method(*args, **kwargs)
+    return timer() - start, rst
+
+
+# 百分位数
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+# 删除测试过程中导入的插件模块
+def unloadModules(prefix):
+    for name in [i for i in sys.modules if i.startswith(modules.MODULE_PREFIX) and prefix in i]:
+        del sys.modules[name]
+
+
+# 当前进程的常驻内存（KB），不支持时返回None
+def rss():
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def benchDiscovery(root, args):
+    result = {}
+    loaderObj = loader.PluginLoader()
+    result["findPluginsCold"], plugins = measure(loaderObj.findPlugins, pluginDir=root, loop=True)
+    result["findPluginsNoChange"], _ = measure(loaderObj.findPlugins, pluginDir=root, loop=True)
+    result["plugins"] = len(plugins)
+    loader._fingerprints.clear()
+    result["md5SumCold"], _ = measure(loader.md5Sum, root)
+    result["md5SumNoChange"], _ = measure(loader.md5Sum, root)
+    return result
+
+
+def benchReload(root, paths, args, prefix):
+    result = {}
+    unloadModules(prefix)
+    loaderObj = loader.PluginLoader()
+    result["loadPluginsFull"], _ = measure(loaderObj.loadPlugins, pluginDir=root, loop=True)
+    result["loadPluginsNoChange"], _ = measure(loaderObj.loadPlugins, pluginDir=root, loop=True)
+    changed = paths[::max(len(paths) // max(args.changed, 1), 1)][:args.changed]
+    touch(changed)
+    result["loadPluginsIncremental"], _ = measure(loaderObj.loadPlugins, pluginDir=root, loop=True)
+    result["changed"] = len(changed)
+    # 通过中间件增量重载
+    mid = middleware.Middleware()
+    mid.funcAppend(mainFunc)
+    mid.addPlugin2Func(mainFunc, pluginDir=root, loop=True, position="before")
+    result["updatePluginFull"], _ = measure(mid.updatePlugin)
+    touch(changed)
+    result["updatePluginIncremental"], _ = measure(mid.updatePlugin)
+    return result
+
+
+def benchBinding(args):
+    result = {}
+    calls = args.calls
+
+    def target(a, b, c=1, d=None):
+        return a
+
+    mid = middleware.Middleware()
+    mid.funcAppend(target)
+    mid.addParam2Func(target, a=1, b=2, d=3)
+    result["binderCreate"] = measure(lambda: [middleware.Binder(target) for _ in range(calls)])[0] / calls
+    result["callFunc"] = measure(lambda: [mid.callFunc(target) for _ in range(calls)])[0] / calls
+    return result
+
+
+def mainFunc(a=None):
+    return {"errCode": 0, "errMsg": "success"}
+
+
+def benchProcess(root, args, prefix):
+    unloadModules(prefix)
+    mid = middleware.Middleware()
+    funcs = []
+    for i in range(args.funcs):
+        # 每个主函数是独立的函数对象
+        func = (lambda: lambda a=None: {"errCode": 0, "errMsg": "success"})()
+        func.__name__ = "func%s" % i
+        mid.funcAppend(func)
+        mid.addPlugin2Func(func, pluginDir=root, loop=True, position="before")
+        funcs.append(func)
+    mid.addParam2Plugin(a=1, b=2)
+    mid.process()  # 预热，导入所有插件
+    latencies = []
+    for _ in range(args.cycles):
+        latencies.append(measure(mid.process)[0])
+    total = sum(latencies)
+    return {
+        "cycles": args.cycles,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "mean": total / len(latencies),
+        "chainsPerSecond": args.funcs * args.cycles / total if total else 0,
+    }
+
+
+def benchServer(root, args, prefix):
+    unloadModules(prefix)
+    mid = middleware.Middleware()
+    mid.funcAppend(mainFunc)
+    mid.addPlugin2Func(mainFunc, pluginDir=root, loop=True, position="before")
+    mid.addParam2Plugin(a=1, b=2)
+    path = os.path.join(tempfile.mkdtemp(prefix="simple-plugin-sock-"), "server.sock")
+    srv = server.JobServer(mid, path, workers=args.workers, queueSize=args.queueSize, reloadInterval=None)
+    srv.start()
+    try:
+        # 单任务往返延迟
+        client = server.Client(path)
+        latencies = [measure(client.call, "mainFunc", {"a": 1})[0] for _ in range(args.cycles)]
+        client.close()
+        # 多个客户端连续发送任务的吞吐量
+        perClient = max(args.jobs // args.clients, 1)
+        errors = []
+
+        def send():
+            client = server.Client(path)
+            try:
+                results = client.callMany([("mainFunc", {"a": i}) for i in range(perClient)])
+                errors.extend(rst for rst in results if rst is not None and rst.get("errCode"))
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=send) for _ in range(args.clients)]
+        start = timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        total = timer() - start
+        stats = srv.stats()
+    finally:
+        srv.shutdown()
+        shutil.rmtree(os.path.dirname(path))
+    return {
+        "jobs": perClient * args.clients,
+        "clients": args.clients,
+        "workers": args.workers,
+        "errors": len(errors),
+        "rejected": stats["rejected"],
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "jobsPerSecond": perClient * args.clients / total if total else 0,
+    }
+
+
+def benchSoak(root, paths, args, prefix):
+    unloadModules(prefix)
+    mid = middleware.Middleware()
+    mid.funcAppend(mainFunc)
+    mid.addPlugin2Func(mainFunc, pluginDir=root, loop=True, position="before")
+    mid.addParam2Plugin(a=1, b=2)
+    changed = paths[:args.changed]
+    mid.process()
+    # 预热若干轮，使内存分配达到稳定状态
+    for _ in range(min(args.soak, 10)):
+        touch(changed)
+        mid.process()
+    gc.collect()
+    start, moduleCount = rss(), len(sys.modules)
+    for _ in range(args.soak):
+        touch(changed)
+        mid.process()
+    gc.collect()
+    end = rss()
+    stats = mid.moduleStats()["%s (loop)" % root]
+    return {
+        "reloads": args.soak,
+        "rssStartKB": start,
+        "rssEndKB": end,
+        "rssGrowthKB": end - start if start is not None and end is not None else None,
+        "modulesGrowth": len(sys.modules) - moduleCount,
+        "liveGenerations": len(stats["generations"]),
+        "liveModules": sum(i["modules"] for i in stats["generations"].values()),
+        "liveBytes": sum(i["bytes"] for i in stats["generations"].values()),
+    }
+
+
+# 与之前的结果对比，返回各项耗时的比值（当前/之前）
+def compare(current, previous):
+    ratios = {}
+    for group, values in current["results"].items():
+        for name, value in values.items():
+            old = previous.get("results", {}).get(group, {}).get(name)
+            if isinstance(value, float) and isinstance(old, float) and old:
+                ratios["%s.%s" % (group, name)] = round(value / old, 3)
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simple-plugin benchmark")
+    parser.add_argument("--plugins", type=int, default=1000, help="插件数量")
+    parser.add_argument("--depth", type=int, default=2, help="子目录嵌套深度（loop=True）")
+    parser.add_argument("--size", type=int, default=256, help="插件文件大小（字节）")
+    parser.add_argument("--signature", default="mixed", choices=sorted(SIGNATURES) + ["mixed"], help="run方法签名形式")
+    parser.add_argument("--changed", type=int, default=10, help="增量重载时修改的插件数量")
+    parser.add_argument("--calls", type=int, default=100000, help="绑定测试的调用次数")
+    parser.add_argument("--funcs", type=int, default=10, help="process测试的主函数数量")
+    parser.add_argument("--cycles", type=int, default=50, help="process测试的周期数")
+    parser.add_argument("--jobs", type=int, default=20000, help="server测试的任务总数")
+    parser.add_argument("--clients", type=int, default=4, help="server测试的并发客户端数量")
+    parser.add_argument("--workers", type=int, default=4, help="server测试的工作线程数")
+    parser.add_argument("--queueSize", type=int, default=1000, help="server测试的任务队列长度")
+    parser.add_argument("--soak", type=int, default=200, help="soak测试的重载次数")
+    parser.add_argument("--label", default="", help="结果标签，例如提交号")
+    parser.add_argument("--output", help="结果输出文件，默认输出到标准输出")
+    parser.add_argument("--compare", help="之前的结果文件，输出各项耗时比值")
+    args = parser.parse_args()
+
+    prefix = "bench%s_" % os.getpid()
+    root = tempfile.mkdtemp(prefix="simple-plugin-bench-")
+    try:
+        paths = makeTree(root, args.plugins, args.depth, args.size, args.signature, prefix)
+        result = {
+            "meta": {
+                "label": args.label,
+                "time": int(time.time()),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": vars(args),
+            },
+            "results": {
+                "discovery": benchDiscovery(root, args),
+                "reload": benchReload(root, paths, args, prefix),
+                "binding": benchBinding(args),
+                "process": benchProcess(root, args, prefix),
+                "server": benchServer(root, args, prefix),
+                "soak": benchSoak(root, paths, args, prefix),
+            },
+        }
+    finally:
+        shutil.rmtree(root)
+        unloadModules(prefix)
+    if args.compare:
+        with open(args.compare) as fd:
+            result["compare"] = compare(result, json.load(fd))
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fd:
+            fd.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
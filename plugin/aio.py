@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+
+"""
+基于asyncio执行中间件的函数调用链，由Middleware.aprocess按需导入（需要Python 3.7+）
+
+PS:
+    1. 插件的run和主函数可以是async def，直接await；普通函数放到事件循环默认的executor中执行，不阻塞事件循环
+    2. 各主函数的调用链并发执行，同时执行的调用链数量由信号量限制；调用链内插件仍按顺序执行
+    3. 函数前插件返回假值时中断调用链，主函数errCode不为0时跳过函数后插件，与process一致
+    4. 开启执行保护时超时通过asyncio.wait_for实现，超时的普通函数仍会在executor中执行完
+"""
+
+import asyncio
+import functools
+from inspect import isfunction, iscoroutinefunction
+from .metrics import timer
+from .guard import PluginTimeout
+from .middleware import Binder, errorResult, pluginStopped, funcFailed, chainStopped
+
+
+# 函数执行，开启执行保护时限制超时并经过插件熔断器；deadline为调用链的截止时间
+async def callFunc(mid, func, plugin=False, deadline=None):
+    binder = mid.binders.get(func)
+    if binder is None:
+        binder = mid.binders[func] = Binder(func)
+    guard = mid.guard
+    # 获取对应参数
+    if not plugin:
+        param = mid.funcParam.get(binder.name, {})
+        if guard is None:
+            return await observe(mid, func, binder, param)
+        try:
+            return await waitFor(observe(mid, func, binder, param), guard.timeout(deadline=deadline), binder.name)
+        except PluginTimeout as e:
+            mid.logger.warning("func %s" % e)
+            return errorResult(e)
+    param = mid.pluginExecParam
+    # 声明了CACHE的插件先查找缓存
+    cache = mid.pluginCache(func, binder)
+    key = None
+    if cache is not None:
+        key = cache.key(param)
+        hit, rst = cache.get(key)
+        if hit:
+            return rst
+    if guard is None:
+        return await observe(mid, func, binder, param, plugin, cache, key)
+    # 与Guard.callPlugin相同的熔断流程，只是超时通过asyncio.wait_for实现
+    name = binder.pluginName
+    breaker = guard.pluginBreaker(name, binder.pluginKey)
+    if breaker is None:
+        return guard.openResult
+    try:
+        rst = await waitFor(observe(mid, func, binder, param, plugin, cache, key), guard.timeout(name, deadline), name)
+    except Exception as e:
+        return guard.pluginFailed(breaker, e)
+    breaker.success()
+    return rst
+
+
+# 等待协程执行完成，超过timeout秒时抛出PluginTimeout；timeout为None时不限制
+async def waitFor(coro, timeout, name):
+    if timeout is None:
+        return await coro
+    if timeout <= 0:
+        coro.close()
+        raise PluginTimeout("%s deadline exceeded" % name)
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise PluginTimeout("%s timed out after %.3fs" % (name, timeout))
+
+
+# 执行函数，开启统计时记录耗时；传入cache时缓存执行结果
+async def observe(mid, func, binder, param, plugin=False, cache=None, key=None):
+    if mid.metrics is None:
+        rst = await invoke(func, binder, param)
+    else:
+        kind, name = ("plugin", binder.pluginKey) if plugin else ("func", binder.name)
+        start = timer()
+        try:
+            rst = await invoke(func, binder, param)
+        except Exception:
+            mid.metrics.record(kind, name, timer() - start, error=True)
+            raise
+        stopped = pluginStopped(rst) if plugin else funcFailed(rst)
+        mid.metrics.record(kind, name, timer() - start, shortCircuit=stopped)
+    if cache is not None:
+        cache.set(key, rst)
+    return rst
+
+
+# 执行函数。async def直接await，普通函数放到默认executor中执行
+async def invoke(func, binder, param):
+    if iscoroutinefunction(func):
+        return await binder(param)
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(binder, param))
+
+
+# 执行插件列表，返回False表示有插件返回假值或超过截止时间，需要中断调用链
+async def runPlugins(mid, func, plugins, deadline=None):
+    if not plugins:
+        return True
+    if not mid.parallel:
+        for p in plugins:
+            if mid.chainExpired(func, deadline):
+                return False
+            method = getattr(p.module, "run", None)
+            if isfunction(method) and not await callFunc(mid, method, plugin=True, deadline=deadline):
+                return False
+        return True
+    # 按阶段执行，同一阶段的插件并发执行，有插件返回假值时不再执行后续阶段
+    for stage in mid.pluginStages(plugins):
+        if mid.chainExpired(func, deadline):
+            return False
+        results = await asyncio.gather(*[callFunc(mid, p.module.run, plugin=True, deadline=deadline) for p in stage])
+        if not all(results):
+            return False
+    return True
+
+
+# 执行单个主函数的调用链，返回主函数的执行结果；没有插件或被函数前插件中断时返回None
+async def runChain(mid, func, semaphore, deadline=None, snapshot=None):
+    async with semaphore:
+        if mid.guard is not None:
+            deadline = mid.guard.chainDeadline(deadline)
+        if mid.metrics is None:
+            return await execChain(mid, func, deadline, snapshot)
+        start = timer()
+        try:
+            rst = await execChain(mid, func, deadline, snapshot)
+        except Exception:
+            mid.metrics.record("chain", func.__name__, timer() - start, error=True)
+            raise
+        mid.metrics.record("chain", func.__name__, timer() - start, shortCircuit=chainStopped(rst))
+        return rst
+
+
+# 执行调用链
+async def execChain(mid, func, deadline=None, snapshot=None):
+    plugins = (snapshot.plugin if snapshot is not None else mid.plugin).get(func.__name__)
+    if not plugins:
+        return None
+    if not await runPlugins(mid, func, plugins.get("before"), deadline):
+        return None
+    rst = await callFunc(mid, func, deadline=deadline)
+    if rst["errCode"] == 0:
+        await runPlugins(mid, func, plugins.get("after"), deadline)
+    return rst
+
+
+# 执行调用链，异常转换为错误结果；周期时间预算用完后不再执行
+async def safeRunChain(mid, func, semaphore, deadline=None, snapshot=None):
+    if mid.guard is not None and mid.guard.expired(deadline):
+        return mid.budgetExhausted(func)
+    try:
+        return await runChain(mid, func, semaphore, deadline, snapshot)
+    except Exception as e:
+        mid.logger.exception("func %s call chain failed: %s" % (func.__name__, e))
+        return errorResult(e)
+
+
+# 并发执行所有主函数的调用链
+async def process(mid, concurrency=100):
+    # 插件重载涉及文件读写，放到executor中执行；各调用链都使用开始时的调用链快照
+    snapshot = await asyncio.get_running_loop().run_in_executor(None, mid.refresh)
+    semaphore = asyncio.Semaphore(concurrency)
+    funcList = list(mid.funcList)
+    deadline = mid.guard.cycleDeadline() if mid.guard is not None else None
+    results = await asyncio.gather(*[safeRunChain(mid, func, semaphore, deadline, snapshot) for func in funcList])
+    return dict(zip([func.__name__ for func in funcList], results))
@@ -0,0 +1,204 @@
+# -*- coding:utf-8 -*-
+
+"""
+执行保护：超时、时间预算及插件熔断
+    1. 插件超时：pluginTimeout为所有插件的默认超时时间，pluginTimeouts可按插件名称单独设置
+    2. 调用链超时：chainTimeout为单个主函数调用链（函数前插件 -> 主函数 -> 函数后插件）的总时间
+    3. 周期预算：cycleBudget为一次process()的总时间，预算用完后剩余的主函数不再执行
+    4. 熔断：插件连续超时或异常failureThreshold次后熔断，cooldown秒内不再执行，
+       按openResult视为通过或中断；冷却后放行一次试探，成功则恢复，失败则继续熔断
+PS:
+    1. 超时的插件无法被强制终止，只是不再等待其结果（在后台守护线程中继续执行）
+    2. 插件超时按timeoutResult处理（默认False，与插件返回假值一致，中断调用链）；主函数超时视为执行失败
+    3. 进程池中执行时熔断器状态保存在子进程中，不会同步到父进程
+    4. processBatch不受执行保护
+"""
+
+import sys
+import logging
+import threading
+from .metrics import timer
+
+
+class PluginTimeout(Exception):
+    """插件或主函数执行超时"""
+
+
+class CircuitBreaker(object):
+    """单个插件的熔断器"""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name, failureThreshold=5, cooldown=30, logger=logging):
+        self.name = name
+        self.failureThreshold = failureThreshold  # 连续失败多少次后熔断
+        self.cooldown = cooldown  # 熔断后的冷却时间（秒）
+        self.logger = logger
+        self.state = self.CLOSED
+        self.failures = 0  # 连续失败次数
+        self.openedAt = 0  # 熔断开始时间
+        self.probing = False  # 半开状态下是否已放行试探
+        self.lock = threading.Lock()
+
+    # 是否允许执行
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN and timer() - self.openedAt >= self.cooldown:
+                self.transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+                return True
+            return self.state == self.CLOSED
+
+    # 执行成功
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != self.CLOSED:
+                self.transition(self.CLOSED)
+
+    # 执行失败（超时或异常）
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failureThreshold):
+                self.openedAt = timer()
+                self.transition(self.OPEN)
+
+    def transition(self, state):
+        self.logger.warning("plugin %s circuit breaker %s -> %s (failures: %s)" % (
+            self.name, self.state, state, self.failures))
+        self.state = state
+
+
+# 在守护线程中执行，超过timeout秒未返回时抛出PluginTimeout；timeout为None时直接执行
+def callWithTimeout(method, args=(), timeout=None, name=None):
+    if timeout is None:
+        return method(*args)
+    if timeout <= 0:
+        raise PluginTimeout("%s deadline exceeded" % name)
+    box = {}
+
+    def target():
+        try:
+            box["rst"] = method(*args)
+        except BaseException:
+            box["error"] = sys.exc_info()[1]
+
+    thread = threading.Thread(target=target, name="timeout-%s" % name)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise PluginTimeout("%s timed out after %.3fs" % (name, timeout))
+    if "error" in box:
+        raise box["error"]
+    return box["rst"]
+
+
+class Guard(object):
+    """执行保护配置及各插件的熔断器"""
+
+    def __init__(self, pluginTimeout=None, pluginTimeouts=None, chainTimeout=None, cycleBudget=None,
+                 failureThreshold=5, cooldown=30, openResult=True, timeoutResult=False, logger=logging):
+        """入参：
+            pluginTimeout: 插件默认超时时间（秒），None为不限制
+            pluginTimeouts: 各插件单独的超时时间。示例：{"00_func": 0.5}
+            chainTimeout: 单个调用链的超时时间（秒）
+            cycleBudget: 一次process()的时间预算（秒）
+            failureThreshold: 插件连续失败多少次后熔断
+            cooldown: 熔断后的冷却时间（秒）
+            openResult: 熔断期间插件的结果，True为跳过插件继续执行，False为中断调用链
+            timeoutResult: 插件超时时的结果
+        """
+        self.pluginTimeout = pluginTimeout
+        self.pluginTimeouts = pluginTimeouts or {}
+        self.chainTimeout = chainTimeout
+        self.cycleBudget = cycleBudget
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self.openResult = openResult
+        self.timeoutResult = timeoutResult
+        self.logger = logger
+        self.breakers = {}  # 各插件的熔断器，按插件模块的命名空间key区分。示例：{"simple_plugin_1a2b3c4d_00_func": breaker}
+        self.lock = threading.Lock()
+
+    # 获取插件的熔断器
+    def breaker(self, name):
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.get(name)
+                if breaker is None:
+                    breaker = self.breakers[name] = CircuitBreaker(name, self.failureThreshold, self.cooldown,
+                                                                   self.logger)
+        return breaker
+
+    # 各熔断器状态。示例：{"simple_plugin_1a2b3c4d_00_func": "open"}
+    def breakerStates(self):
+        return dict((name, breaker.state) for name, breaker in list(self.breakers.items()))
+
+    # 本周期的截止时间
+    def cycleDeadline(self):
+        return None if self.cycleBudget is None else timer() + self.cycleBudget
+
+    # 调用链的截止时间，不超过parent
+    def chainDeadline(self, parent=None):
+        deadline = None if self.chainTimeout is None else timer() + self.chainTimeout
+        if parent is not None and (deadline is None or parent < deadline):
+            deadline = parent
+        return deadline
+
+    # 截止时间是否已过
+    @staticmethod
+    def expired(deadline):
+        return deadline is not None and timer() >= deadline
+
+    # 本次执行的超时时间：插件超时时间与截止时间剩余时间中较小的一个
+    def timeout(self, name=None, deadline=None):
+        timeout = self.pluginTimeouts.get(name, self.pluginTimeout) if name is not None else None
+        if deadline is not None:
+            remaining = deadline - timer()
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        return timeout
+
+    # 插件执行前检查熔断器，允许执行时返回熔断器，熔断期间返回None（插件结果为openResult）
+    def pluginBreaker(self, name, key=None):
+        """入参：
+            name: 插件名称
+            key: 熔断器的key，默认为name。中间件传入插件模块的命名空间key，不同目录中的同名插件分别熔断
+        """
+        breaker = self.breaker(key or name)
+        return breaker if breaker.allow() else None
+
+    # 插件执行失败，在except中调用：记录到熔断器，超时返回timeoutResult，其他异常重新抛出
+    def pluginFailed(self, breaker, error):
+        breaker.failure()
+        if not isinstance(error, PluginTimeout):
+            raise
+        self.logger.warning("plugin %s" % error)
+        return self.timeoutResult
+
+    # 执行插件：熔断期间直接返回openResult，超时返回timeoutResult，异常照常抛出。aio模块使用相同的熔断流程
+    def callPlugin(self, name, method, args=(), deadline=None, key=None):
+        """入参：
+            name: 插件名称，用于查找pluginTimeouts
+            key: 熔断器的key，见pluginBreaker
+        """
+        breaker = self.pluginBreaker(name, key)
+        if breaker is None:
+            return self.openResult
+        try:
+            rst = callWithTimeout(method, args, self.timeout(name, deadline), name)
+        except Exception as e:
+            return self.pluginFailed(breaker, e)
+        breaker.success()
+        return rst
+
+    # 执行主函数，超过截止时间时抛出PluginTimeout
+    def callFunc(self, name, method, args=(), deadline=None):
+        return callWithTimeout(method, args, self.timeout(deadline=deadline), name)
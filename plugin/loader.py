@@ -8,92 +8,422 @@
     如果是自动导入插件，那么模块的顺序会影响插件执行顺序！！！
 2. loadPlugin 手动导入插件
     如果是手动导入插件，那么手动导入的顺序会影响插件运行顺序！！！
+插件按所在目录区分命名空间导入（见modules），插件变化或删除后旧模块从sys.modules中移除
 """
 
 import os
+import sys
 import imp
+import atexit
 import glob
+import json
+import stat
 import hashlib
+import logging
+import threading
+from inspect import isfunction
+from .metrics import timer
+from .modules import ModuleTracker, importModule, evictModule
+from .registry import PluginRecord, PluginRegistry
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # Python 2可安装scandir包
+    except ImportError:
+        scandir = None
+
+HASH_CHUNK_SIZE = 64 * 1024  # 计算md5时每次读取的字节数
+SCAN_WORKERS = 8  # 并行遍历子目录、计算md5的线程数，为1时顺序执行
+MANIFEST_VERSION = 1  # 查找结果清单格式版本，格式变化时加1，旧版本清单会被忽略
+_fingerprints = {}  # md5Sum使用的文件指纹缓存。示例：{path: ((mtime_ns, size, inode), md5)}
+_scanPool = None  # 查找插件共用的线程池：(创建线程池的进程号, 线程池)，fork出的子进程中重新创建
+_scanPoolLock = threading.Lock()
+
+
+# 判断是否为插件文件
+def isPluginFile(entry):
+    return glob.fnmatch.fnmatch(entry, "*.py") or glob.fnmatch.fnmatch(entry, "*.pyc")
+
+
+# 文件的stat指纹：(mtime_ns, size, inode)
+def statKey(st):
+    mtime = getattr(st, "st_mtime_ns", None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return mtime, st.st_size, st.st_ino
+
+
+# 计算单个文件的md5值
+def fileMd5(entry, st=None, cache=None, newCache=None, metrics=None):
+    """先比较stat指纹，未变化则直接返回缓存中的md5，变化时才分块读取文件计算
+
+    入参：
+        entry: 文件路径
+        st: 已获取的os.stat结果，避免重复stat
+        cache: 上一次的指纹缓存，默认使用模块级缓存
+        newCache: 本次结果写入的缓存，默认与cache相同
+        metrics: 统计实例，实际计算md5时记录耗时
+    """
+    if cache is None:
+        cache = _fingerprints
+    if newCache is None:
+        newCache = cache
+    if st is None:
+        st = os.stat(entry)
+    key = statKey(st)
+    cached = cache.get(entry)
+    if cached and cached[0] == key:
+        newCache[entry] = cached
+        return cached[1]
+    start = timer() if metrics is not None else 0
+    md5 = hashlib.md5()
+    with open(entry, "rb") as fd:
+        for chunk in iter(lambda: fd.read(HASH_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    newCache[entry] = (key, md5.hexdigest())
+    if metrics is not None:
+        metrics.record("loader", "hash", timer() - start)
+    return newCache[entry][1]
+
+
+# 列出目录中的插件文件及子目录，顺序与os.listdir一致
+def scanDir(pluginDir, loop=False):
+    """返回：[(是否目录, 模块名称, 路径, os.stat结果)]，目录的模块名称为None，loop为False时不返回目录。
+    有scandir时直接使用目录项中的类型信息，只对插件文件和子目录stat；遍历过程中被删除的条目会被忽略
+    """
+    entries = []
+    try:
+        if scandir is None:
+            items = [(item, os.path.join(pluginDir, item), None) for item in os.listdir(pluginDir)]
+        else:
+            items = [(entry.name, entry.path, entry) for entry in scandir(pluginDir)]
+    except OSError:
+        return entries  # 遍历过程中目录已被删除
+    for item, location, entry in items:
+        moduleName, suffix = os.path.splitext(item)
+        try:
+            if entry is not None:
+                if entry.is_dir():
+                    if loop:
+                        entries.append((True, None, location, entry.stat()))
+                elif entry.is_file() and suffix in (".py", ".pyc") and moduleName != "__init__":
+                    entries.append((False, moduleName, location, entry.stat()))
+                continue
+            st = os.stat(location)
+        except OSError:
+            continue  # 遍历过程中文件已被删除
+        if stat.S_ISDIR(st.st_mode):
+            if loop:
+                entries.append((True, None, location, st))
+        elif stat.S_ISREG(st.st_mode) and suffix in (".py", ".pyc") and moduleName != "__init__":
+            entries.append((False, moduleName, location, st))
+    return entries
+
+
+# 在共用线程池中按顺序执行func(item)，返回结果列表；只有一项时直接执行
+def parallelMap(func, items):
+    global _scanPool
+    if len(items) < 2 or SCAN_WORKERS < 2:
+        return [func(item) for item in items]
+    with _scanPoolLock:
+        if _scanPool is None or _scanPool[0] != os.getpid():
+            _scanPool = (os.getpid(), ThreadPool(SCAN_WORKERS))
+        pool = _scanPool[1]
+    return pool.map(func, items)
+
+
+# 退出时关闭查找插件的线程池
+@atexit.register
+def _closeScanPool():
+    if _scanPool is not None and _scanPool[0] == os.getpid():
+        _scanPool[1].terminate()
+
+
+# 插件run方法的签名：(参数名列表, 必须提供的参数个数)，没有run方法时返回None
+def runSignature(module):
+    method = getattr(module, "run", None)
+    if not isfunction(method):
+        return None
+    signature = getargspec(method)
+    return list(signature[0]), len(signature[0]) - len(signature[3] or ())
 
 
 # 计算文件或目录的md5值
-def md5Sum(entry):
+def md5Sum(entry, cache=None):
+    """文件直接计算md5；目录按相对路径排序后，汇总其中所有插件文件的md5。
+    各文件的md5都经过指纹缓存，目录中未变化的文件只需要stat
+    """
+    if os.path.isfile(entry) and isPluginFile(entry):
+        return fileMd5(entry, cache=cache)
     md5 = hashlib.md5()
-    if os.path.isfile(entry) and (glob.fnmatch.fnmatch(entry, "*.py") or glob.fnmatch.fnmatch(entry, "*.pyc")):
-        with open(entry, "rb") as fd:
-            md5.update(fd.read())
     if os.path.isdir(entry):
         for path, dirList, fileList in os.walk(entry):
-            for f in fileList:
-                if not (glob.fnmatch.fnmatch(f, "*.py") and glob.fnmatch.fnmatch(f, "*.pyc")):
+            dirList.sort()
+            for f in sorted(fileList):
+                if not isPluginFile(f):
                     continue
-                with open(os.path.join(path, f), "rb") as fd:
-                    md5.update(fd.read())
+                location = os.path.join(path, f)
+                for item in (os.path.relpath(location, entry), fileMd5(location, cache=cache)):
+                    md5.update(item if isinstance(item, bytes) else item.encode(sys.getfilesystemencoding()))
     return md5.hexdigest()
 
 
 class PluginLoader(object):
     """plugin加载器。根据plugins目录查找并导入文件"""
     
-    def __init__(self, pluginDir=None):
-        self.plugins = []  # 存放加载的模块信息,使用列表是因为列表有序
+    def __init__(self, pluginDir=None, lazy=False, logger=logging, manifest=None, metrics=None):
+        self.plugins = PluginRegistry()  # 存放加载的模块信息，按名称索引且有序
+        self.lazy = lazy  # 是否延迟导入：查找时只记录路径和md5，第一次使用插件时才导入
+        self.logger = logger
+        self.metrics = metrics  # metrics.Metrics实例，统计查找、计算md5、导入的耗时，为None时不统计
+        self.importLock = threading.Lock()  # 延迟导入时防止多个线程重复导入同一插件
+        self.modules = ModuleTracker()  # 已导入且尚未释放的插件模块
+        self.failed = {}  # 导入失败的插件，md5变化前不再重新导入。示例：{path: md5}
         if pluginDir and not os.path.isdir(pluginDir):
             raise ValueError("%s must be dir" % pluginDir)
         self.pluginDir = pluginDir  # 模块路径
+        self.fingerprints = {}  # 上一次查找时各插件文件及目录的指纹，目录的md5为None。示例：{path: ((mtime_ns, size, inode), md5)}
+        self.stale = True  # 插件是否可能已变化，需要重新查找。loadPlugins后置为False，invalidate后置为True
+        self.manifest = manifest  # 查找结果清单文件路径，重启后用于跳过重新查找和计算md5
+        self.manifestData = None  # 从清单读取的内容，只在第一次加载时使用
+        self.manifestDirty = False  # 是否有新的签名信息需要写入清单
+        if manifest:
+            self.readManifest()
     
     # 返回插件名称
     @property
     def pluginsName(self):
-        pluginName = [i.keys()[0] for i in self.plugins]
-        return pluginName
+        return self.plugins.names
+    
+    # 插件代数，插件有新增、更新或删除时加1
+    @property
+    def generation(self):
+        return self.plugins.generation
     
     # 查找可导入的module
     def findPlugins(self, pluginDir=None, loop=False):
-        """遍历目录，查找可导入plugin
+        """遍历目录，查找可导入plugin。每个文件只stat一次，stat未变化的文件复用上次的md5
+        同一层的子目录及需要计算md5的文件在线程池中并行处理，结果仍按目录深度优先、目录内os.listdir的顺序排列
         参数：
             pluginDir: 查找路径
             loop: 是否在子目录中递归加载插件
         """
-        plugins = []
         if not (pluginDir and os.path.isdir(pluginDir)):
-            pluginDir = self.pluginDir
-        # 遍历目录
-        for item in os.listdir(pluginDir):
-            # 文件拆分为文件名和后缀
-            moduleName, suffix = os.path.splitext(item)
-            location = os.path.join(pluginDir, item)
-            if os.path.isdir(location):
-                if loop:
-                    plugins.extend(self.findPlugins(pluginDir=location, loop=loop))
-                continue
-            elif os.path.isfile(location) and suffix in [".py", ".pyc"] and moduleName != "__init__":
-                info = imp.find_module(moduleName, [pluginDir])
+            pluginDir = self.pluginDir or pluginDir
+        # 插件目录不存在（例如已被删除）时视为没有插件；目录的指纹为空，目录重新创建后清单随之失效
+        if not (pluginDir and os.path.isdir(pluginDir)):
+            self.fingerprints = {pluginDir: ((), None)} if pluginDir else {}
+            return []
+        fingerprints = {pluginDir: (statKey(os.stat(pluginDir)), None)}
+        # 逐层并行遍历目录
+        listings = {}
+        level = [pluginDir]
+        while level:
+            nextLevel = []
+            for d, entries in zip(level, parallelMap(lambda d: scanDir(d, loop), level)):
+                listings[d] = entries
+                for isDir, moduleName, location, st in entries:
+                    if isDir:
+                        fingerprints[location] = (statKey(st), None)
+                        nextLevel.append(location)
+            level = nextLevel
+        # 按深度优先顺序展开，同名插件只保留先找到的
+        candidates = []
+        names = set()
+        stack = [iter(listings[pluginDir])]
+        while stack:
+            for isDir, moduleName, location, st in stack[-1]:
+                if isDir:
+                    stack.append(iter(listings[location]))
+                    break
+                if moduleName not in names:
+                    candidates.append((moduleName, location, st))
+                    names.add(moduleName)
             else:
-                continue
-            if moduleName not in [i["name"] for i in plugins]:
-                plugins.append({"name": moduleName, "info": info, "md5": md5Sum(location)})
+                stack.pop()
+        # stat未变化的直接复用md5，其余并行计算
+        changed = [c for c in candidates if (self.fingerprints.get(c[1]) or (None,))[0] != statKey(c[2])]
+        parallelMap(lambda c: self.hashPlugin(c[1], c[2], fingerprints), changed)
+        plugins = []
+        for moduleName, location, st in candidates:
+            md5 = self.hashPlugin(location, st, fingerprints)
+            if md5 is not None:
+                plugins.append({"name": moduleName, "path": location, "md5": md5})
+        self.fingerprints = fingerprints
         return plugins
     
-    # 加载plugin。调用findPlugins查找可用plugin并加载
+    # 计算插件文件的md5并写入本次的指纹缓存，文件已被删除时返回None
+    def hashPlugin(self, location, st, fingerprints):
+        cached = fingerprints.get(location)
+        if cached:
+            return cached[1]
+        try:
+            return fileMd5(location, st=st, cache=self.fingerprints, newCache=fingerprints, metrics=self.metrics)
+        except (IOError, OSError):
+            return None
+    
+    # 导入插件记录对应的模块，导入失败时模块为None
+    def importPlugin(self, record):
+        with self.importLock:
+            if record.importer is None:
+                return  # 其他线程已导入
+            start = timer() if self.metrics is not None else 0
+            try:
+                # 正在加载的新一代插件代数更大；已被替换的插件（延迟导入时执行中的旧快照）不注册到sys.modules
+                current = self.plugins.get(record.name) is record or record.generation > self.plugins.generation
+                record._module = importModule(record.name, record.path, register=current)
+                self.modules.track(record)
+                if record.signature is None:
+                    record.signature = runSignature(record._module)
+                    self.manifestDirty = True
+            except Exception as e:
+                # 插件中的语法错误或导入时执行的代码抛出的异常同样只跳过该插件
+                self.failed[record.path] = record.md5
+                self.logger.warning("import plugin %s failed: %s" % (record.path, e))
+            finally:
+                record.importer = None
+                if self.metrics is not None:
+                    self.metrics.record("loader", "import", timer() - start, error=record._module is None)
+    
+    # 加载plugin。调用findPlugins查找可用plugin，只重新导入新增或有变化的插件
     def loadPlugins(self, pluginDir=None, loop=None):
-        newPlugins = self.findPlugins(pluginDir=pluginDir, loop=loop)
-        # 删除已卸载的插件，加载新的插件
-        plugins = []
+        """增量加载插件。上一代中md5未变化的插件直接复用已导入的module，
+        只有新增或md5变化的插件才会重新导入，已删除的插件随之移除。
+        延迟导入时新增或变化的插件只记录路径和md5，第一次访问module时才导入。
+        非延迟导入时变化后的插件导入失败（例如语法错误），继续使用上一版本，直到文件再次变化。
+        插件有变化时generation加1
+        """
+        start = timer() if self.metrics is not None else 0
+        if not (pluginDir and os.path.isdir(pluginDir)):
+            pluginDir = self.pluginDir or pluginDir
+        # 清单有效时直接使用清单中的查找结果，否则重新查找（未变化的文件仍复用清单中的md5）
+        newPlugins, signatures = self.checkManifest(pluginDir, loop)
+        fromManifest = newPlugins is not None
+        if not fromManifest:
+            newPlugins = self.findPlugins(pluginDir=pluginDir, loop=loop)
+        if self.metrics is not None:
+            self.metrics.record("loader", "discovery", timer() - start)
+        # 上一代已加载的插件
+        oldPlugins = self.plugins
+        changed = False
+        # 已删除的插件不再记录导入失败
+        if self.failed:
+            paths = set(i["path"] for i in newPlugins)
+            self.failed = dict((k, v) for k, v in self.failed.items() if k in paths)
+        # 删除已卸载的插件，加载新的或有变化的插件
+        plugins = PluginRegistry(generation=oldPlugins.generation)
         for plugin in newPlugins:
-            newPlugin = {}
-            try:
-                p = {"module": imp.load_module(plugin["name"], *plugin["info"]), "md5": plugin["md5"]}
-                newPlugin[plugin["name"]] = p
-            except ImportError:
+            if plugin["name"] in plugins:
                 continue
-            else:
-                plugins.append(newPlugin)
-            finally:
-                if plugin["info"][0]:
-                    plugin["info"][0].close()
+            record = previous = oldPlugins.get(plugin["name"])
+            if not (record and record.md5 == plugin["md5"] and record.path == plugin["path"]):
+                # 导入失败且文件未变化的插件不再重新导入，继续使用上一版本
+                if self.failed.get(plugin["path"]) == plugin["md5"]:
+                    if previous is not None:
+                        plugins.extend([previous])
+                    continue
+                record = PluginRecord(plugin["name"], md5=plugin["md5"], path=plugin["path"],
+                                      importer=self.importPlugin, generation=oldPlugins.generation + 1)
+                # 清单中md5一致的签名信息可以直接使用，不需要重新解析
+                signature = signatures.get(plugin["path"])
+                if signature and signature[0] == plugin["md5"]:
+                    record.signature = (signature[1], signature[2])
+                # 非延迟导入时立即导入，导入失败时继续使用上一版本，没有上一版本的插件不加载
+                if not self.lazy and record.module is None:
+                    if previous is not None:
+                        plugins.extend([previous])
+                    continue
+                changed = True
+            plugins.extend([record])
+        changed = changed or plugins.names != oldPlugins.names
+        if changed:
+            plugins.generation += 1
         self.plugins = plugins
+        # 已变化或删除的插件移出sys.modules，旧模块在不再被调用链快照引用后释放
+        for record in oldPlugins:
+            if plugins.get(record.name) is not record:
+                evictModule(record)
+        self.stale = False
+        if self.manifest and ((changed and not fromManifest) or self.manifestDirty):
+            self.writeManifest(pluginDir, loop, newPlugins)
+        if self.metrics is not None:
+            self.metrics.record("loader", "reload", timer() - start)
         return self.plugins
     
+    # 读取查找结果清单，清单损坏或版本不一致时忽略
+    def readManifest(self):
+        try:
+            with open(self.manifest) as fd:
+                data = json.load(fd)
+            if data.get("version") != MANIFEST_VERSION:
+                raise ValueError("manifest version %s not supported" % data.get("version"))
+            fingerprints = dict((i[0], (tuple(i[1]), i[2])) for i in data["fingerprints"])
+            plugins = [{"name": i[0], "path": i[1], "md5": i[2]} for i in data["plugins"]]
+            signatures = dict((i[0], (i[1], i[2], i[3])) for i in data["signatures"])
+        except (IOError, OSError):
+            return  # 清单不存在
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            self.logger.warning("ignore invalid plugin manifest %s: %s" % (self.manifest, e))
+            return
+        self.manifestData = {"pluginDir": data.get("pluginDir"), "loop": data.get("loop"), "plugins": plugins,
+                             "signatures": signatures}
+        # 即使清单已过期，未变化的文件也不需要重新计算md5
+        self.fingerprints = fingerprints
+    
+    # 校验清单：清单中所有目录和文件的stat指纹都未变化时，返回清单中的查找结果，否则返回None
+    def checkManifest(self, pluginDir, loop):
+        data, self.manifestData = self.manifestData, None
+        if not data:
+            return None, {}
+        if data["pluginDir"] != pluginDir or data["loop"] != bool(loop):
+            return None, data["signatures"]
+        for path, (key, md5) in self.fingerprints.items():
+            try:
+                if statKey(os.stat(path)) != key:
+                    return None, data["signatures"]
+            except OSError:
+                return None, data["signatures"]
+        return data["plugins"], data["signatures"]
+    
+    # 写入查找结果清单。先写临时文件再rename，多个进程同时写入时读到的也总是完整的清单
+    def writeManifest(self, pluginDir, loop, plugins):
+        data = {
+            "version": MANIFEST_VERSION,
+            "pluginDir": pluginDir,
+            "loop": bool(loop),
+            "plugins": [[i["name"], i["path"], i["md5"]] for i in plugins],
+            "fingerprints": [[path, list(key), md5] for path, (key, md5) in self.fingerprints.items()],
+            "signatures": [[i.path, i.md5, i.signature[0], i.signature[1]] for i in self.plugins if i.signature],
+        }
+        tmp = "%s.%s.%s.tmp" % (self.manifest, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(tmp, "w") as fd:
+                json.dump(data, fd, separators=(",", ":"))
+            os.rename(tmp, self.manifest)
+            self.manifestDirty = False
+        except (IOError, OSError) as e:
+            self.logger.warning("write plugin manifest %s failed: %s" % (self.manifest, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    
+    # 标记插件已变化，下次加载时重新查找
+    def invalidate(self, paths=None):
+        """入参：
+            paths: 变化的文件。这些文件的指纹会被丢弃，即使stat未变化也会重新计算md5
+        """
+        for path in paths or []:
+            self.fingerprints.pop(path, None)
+        self.stale = True
+    
     # 查找module
     def findPlugin(self, pluginDir=None, moduleName=None, loop=False):
         """查找moduleName，并计算md5。如果开启了递归查找，则采用深度优先算法查找模块。
@@ -115,9 +445,8 @@ class PluginLoader(object):
         except ImportError as e:
             if not loop:
                 return False, e
-            for item in os.listdir(pluginDir):
-                location = os.path.join(pluginDir, item)
-                if os.path.isdir(location):
+            for isDir, _, location, _ in scanDir(pluginDir, loop=True):
+                if isDir:
                     ok, plugin = self.findPlugin(pluginDir=location, moduleName=moduleName, loop=loop)
                     if ok:
                         return ok, plugin
@@ -134,38 +463,33 @@ class PluginLoader(object):
         """
         ok, plugin = self.findPlugin(pluginDir=pluginDir, moduleName=moduleName, loop=loop)
         # 如果不存在模块，则删除之前的缓存
-        pluginsName = self.pluginsName
         if not ok:
-            if moduleName in pluginsName:
-                self.delete(moduleName)
+            self.delete(moduleName)
             return ok, plugin
         try:
-            newPlugin = {}
-            if plugin["name"] not in pluginsName:  # 新增模块
-                newPlugin = {"module": imp.load_module(plugin["name"], *plugin["info"]), "md5": plugin["md5"]}
-                self.plugins.append({plugin["name"]: newPlugin})
-            else:  # 更新模块
-                for i in self.plugins:
-                    for name, moduleInfo in i.items():
-                        if name == plugin["name"]:
-                            if moduleInfo["md5"] != plugin["md5"]:
-                                newPlugin = {"module": imp.load_module(plugin["name"], *plugin["info"]),
-                                             "md5": plugin["md5"]}
-                                i[name] = newPlugin
-                            else:
-                                newPlugin = moduleInfo
-        except ImportError:
+            record = self.plugins.get(plugin["name"])
+            # 新增模块或更新模块
+            if not (record and record.md5 == plugin["md5"]):
+                module = importModule(plugin["name"], plugin["info"][1], plugin["info"])
+                record = PluginRecord(plugin["name"], module, plugin["md5"], plugin["info"][1],
+                                      generation=self.plugins.generation + 1)
+                self.plugins.add(record)
+                self.modules.track(record)
+        except Exception as e:
+            self.logger.warning("import plugin %s failed: %s" % (plugin["info"][1], e))
             return False, None
         finally:
             if plugin["info"][0]:
                 plugin["info"][0].close()
-        return True, newPlugin
+        return True, record
     
     # 删除插件
     def delete(self, moduleName):
-        if moduleName not in self.pluginsName:
-            return
-        for plugin in self.plugins:
-            if plugin.keys()[0] == moduleName:
-                self.plugins.remove(plugin)
-                return
+        record = self.plugins.remove(moduleName)
+        if record is not None:
+            evictModule(record)
+    
+    # 卸载所有插件（不再使用该加载器时），模块从sys.modules中移除
+    def unload(self):
+        for record in self.plugins:
+            evictModule(record)
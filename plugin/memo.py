@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+
+"""
+插件执行结果缓存
+插件模块定义CACHE后，Middleware缓存其run方法的结果，相同参数再次执行时直接返回缓存的结果：
+    CACHE = True  # 以run的所有参数为缓存key，默认大小及不过期
+    CACHE = {"keys": ["task", "taskPolicy"], "maxSize": 128, "ttl": 60}
+        keys: 作为缓存key的参数名，默认为run的所有参数
+        maxSize: 最多缓存的结果数量，超出时淘汰最久未使用的
+        ttl: 结果的有效期（秒），None为不过期
+PS:
+    1. 缓存按run方法区分，插件文件md5变化重新导入后是新的run方法，旧缓存随之释放
+    2. 参数值不可哈希（例如dict、list）时不缓存
+    3. 只缓存run正常返回的结果，异常、超时、熔断不缓存
+    4. processBatch中定义了runBatch的插件按整块执行，不使用缓存
+"""
+
+import threading
+from collections import OrderedDict
+from .metrics import timer
+
+MAX_SIZE = 128  # 默认最多缓存的结果数量
+
+
+class PluginCache(object):
+    """带过期时间的LRU缓存，统计命中及未命中次数"""
+
+    def __init__(self, name, keys, maxSize=MAX_SIZE, ttl=None):
+        self.name = name  # 插件名称
+        self.keys = tuple(keys)  # 作为缓存key的参数名
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.items = OrderedDict()  # 示例：{key: (过期时间, 结果)}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # 根据参数集生成缓存key，参数值不可哈希时返回None
+    def key(self, param):
+        key = tuple(param.get(name) for name in self.keys)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    # 查找缓存，返回(是否命中, 结果)
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key) if key is not None else None
+            if item is not None and item[0] is not None and item[0] <= timer():
+                del self.items[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return False, None
+            # 移到末尾，表示最近使用
+            del self.items[key]
+            self.items[key] = item
+            self.hits += 1
+            return True, item[1]
+
+    # 写入缓存，超出大小时淘汰最久未使用的结果
+    def set(self, key, value):
+        if key is None:
+            return
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (timer() + self.ttl if self.ttl is not None else None, value)
+            while len(self.items) > self.maxSize:
+                self.items.popitem(last=False)
+
+    # 清空缓存
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    # 缓存统计。示例：{"hits": 10, "misses": 2, "size": 2, "maxSize": 128, "ttl": 60}
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.items), "maxSize": self.maxSize,
+                    "ttl": self.ttl}
+
+
+# 根据插件模块的CACHE声明创建缓存，未声明或声明无效时返回None
+def fromPlugin(func, binder, logger):
+    """入参：
+        func: 插件的run方法
+        binder: run方法的参数绑定器，keys默认为run的所有参数
+    """
+    config = func.__globals__.get("CACHE")
+    if not config:
+        return None
+    if config is True:
+        config = {}
+    try:
+        if not isinstance(config, dict):
+            raise TypeError("CACHE must be True or dict")
+        keys = config.get("keys")
+        keys = binder.args if keys is None else tuple(keys)
+        maxSize = int(config.get("maxSize", MAX_SIZE))
+        ttl = config.get("ttl")
+        if maxSize < 1:
+            raise ValueError("maxSize must be positive")
+        return PluginCache(binder.pluginName, keys, maxSize, None if ttl is None else float(ttl))
+    except (TypeError, ValueError) as e:
+        logger.warning("plugin %s invalid CACHE %r, not cached: %s" % (binder.pluginName, config, e))
+        return None
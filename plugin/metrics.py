@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+
+"""
+插件执行耗时统计
+统计项按(kind, name)区分：
+    plugin: 各插件run方法，name为插件名称
+    func: 各主函数，name为函数名
+    chain: 各主函数的调用链，name为函数名
+    loader: 插件加载过程，name为discovery（查找）、hash（计算md5）、import（导入）、reload（整次加载）
+    server: 任务服务，name为job（任务从入队到执行完成）
+每项统计调用次数、异常次数、中断次数（插件返回假值、主函数errCode不为0、调用链被函数前插件中断）及耗时直方图
+PS:
+    1. 未开启统计（Middleware的metrics为None）时，执行过程中不会计时，也不会产生额外对象
+    2. 进程池中执行的调用链统计在子进程中，不会汇总到父进程
+"""
+
+import json
+import time
+import bisect
+import threading
+
+timer = getattr(time, "perf_counter", time.time)  # 计时函数，Python 2没有perf_counter
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # 耗时直方图上界（秒）
+
+
+class Metrics(object):
+    """耗时统计"""
+
+    def __init__(self, buckets=BUCKETS, prefix="simple_plugin"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix  # Prometheus指标名前缀
+        self.stats = {}  # 示例：{("plugin", "simple_plugin_1a2b3c4d_00_func"): [调用次数, 异常次数, 中断次数, 总耗时, [各区间次数]]}
+        self.lock = threading.Lock()
+
+    # 记录一次调用
+    def record(self, kind, name, seconds, error=False, shortCircuit=False):
+        with self.lock:
+            stat = self.stats.get((kind, name))
+            if stat is None:
+                stat = self.stats[(kind, name)] = [0, 0, 0, 0.0, [0] * (len(self.buckets) + 1)]
+            stat[0] += 1
+            stat[1] += 1 if error else 0
+            stat[2] += 1 if shortCircuit else 0
+            stat[3] += seconds
+            stat[4][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    # 执行并记录一次调用。shortCircuit(rst)用于判断结果是否中断了调用链
+    def observe(self, kind, name, method, args=(), shortCircuit=None):
+        start = timer()
+        try:
+            rst = method(*args)
+        except Exception:
+            self.record(kind, name, timer() - start, error=True)
+            raise
+        self.record(kind, name, timer() - start, shortCircuit=bool(shortCircuit and shortCircuit(rst)))
+        return rst
+
+    # 清空统计
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    # 返回统计快照
+    def snapshot(self):
+        """返回示例：
+        {
+            "plugin": {
+                "simple_plugin_1a2b3c4d_00_func": {"calls": 3, "errors": 0, "shortCircuits": 1, "sum": 0.0012,
+                                                   "buckets": [[0.0005, 2], [0.001, 3], ..., ["+Inf", 3]]}
+            }
+        }
+        buckets为累计次数；插件以插件模块的命名空间key区分，不同目录中的同名插件分别统计
+        """
+        with self.lock:
+            stats = [(key, list(stat[:4]) + [list(stat[4])]) for key, stat in self.stats.items()]
+        result = {}
+        for (kind, name), (calls, errors, shortCircuits, total, counts) in stats:
+            buckets, cumulative = [], 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                buckets.append([bound, cumulative])
+            result.setdefault(kind, {})[name] = {"calls": calls, "errors": errors, "shortCircuits": shortCircuits,
+                                                 "sum": total, "buckets": buckets}
+        return result
+
+    # 以json格式导出统计
+    def dumpJson(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    # 以Prometheus文本格式导出统计
+    def dumpPrometheus(self):
+        snapshot = self.snapshot()
+        rows = sorted((kind, name, stat) for kind, names in snapshot.items() for name, stat in names.items())
+        lines = []
+        for metric, field in (("calls_total", "calls"), ("errors_total", "errors"),
+                              ("short_circuits_total", "shortCircuits")):
+            lines.append("# TYPE %s_%s counter" % (self.prefix, metric))
+            for kind, name, stat in rows:
+                lines.append('%s_%s{kind="%s",name="%s"} %s' % (self.prefix, metric, kind, escape(name), stat[field]))
+        lines.append("# TYPE %s_latency_seconds histogram" % self.prefix)
+        for kind, name, stat in rows:
+            labels = 'kind="%s",name="%s"' % (kind, escape(name))
+            for bound, count in stat["buckets"]:
+                lines.append('%s_latency_seconds_bucket{%s,le="%s"} %s' % (self.prefix, labels, bound, count))
+            lines.append("%s_latency_seconds_sum{%s} %r" % (self.prefix, labels, stat["sum"]))
+            lines.append("%s_latency_seconds_count{%s} %s" % (self.prefix, labels, stat["calls"]))
+        return "\n".join(lines) + "\n"
+
+
+# 转义Prometheus标签值
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -7,22 +7,149 @@ PS:
     需要注意的是，插件目录如果有同名文件，则只会导入第一个目录中找到的文件
 """
 
-import copy
+import os
+import weakref
+import hashlib
 import logging
-import loader
-from inspect import isfunction, getargspec
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from inspect import isfunction
+from . import loader
+from . import watcher
+from . import memo
+from . import schedule
+from .guard import PluginTimeout
+from .modules import pluginName
+from .registry import PluginRegistry, ChainSnapshot
+from .metrics import timer
+
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
+_forked = None  # 创建进程池前保存的(中间件实例, 调用链快照)，fork出的子进程通过它执行函数调用链
+_forkLock = threading.Lock()
+
+try:
+    _forkContext = multiprocessing.get_context("fork")  # 子进程依赖fork继承_forked，不受默认启动方式影响
+except AttributeError:
+    _forkContext = multiprocessing  # Python 2只有fork方式
+except ValueError:
+    _forkContext = None  # 不支持fork的系统
+
+
+# 进程池中执行第index个主函数的调用链
+def _runForked(index, deadline=None):
+    mid, snapshot = _forked
+    return mid.safeRunChain(mid.funcList[index], deadline, snapshot)
+
+
+# 将异常转换为主函数格式的错误结果
+def errorResult(e):
+    return {"errCode": -1, "errMsg": "%s: %s" % (e.__class__.__name__, e)}
+
+
+# 插件结果是否中断调用链，用于统计
+def pluginStopped(rst):
+    return not rst
+
+
+# 主函数结果是否跳过函数后插件，用于统计
+def funcFailed(rst):
+    return not isinstance(rst, dict) or rst.get("errCode") != 0
+
+
+# 调用链是否被函数前插件中断，用于统计
+def chainStopped(rst):
+    return rst is None
+
+
+# 函数参数绑定器
+class Binder(object):
+    """注册主函数或加载插件时解析一次函数签名，执行时直接按参数名从参数集中取值，
+    不再每次调用都getargspec和deepcopy。插件重新导入后run是新的函数对象，会重新生成绑定器
+    """
+    
+    def __init__(self, func, signature=None):
+        """入参：
+            signature: 已解析的签名(参数名列表, 必须提供的参数个数)，例如插件清单中保存的签名，为None时重新解析
+        """
+        if signature is None:
+            spec = getargspec(func)
+            signature = spec[0], len(spec[0]) - len(spec[3] or ())
+        self.func = func
+        self.name = func.__name__
+        self.pluginName = pluginName(func)  # 插件名称，主函数为其所在模块名
+        self.pluginKey = func.__module__  # 插件模块的命名空间key，熔断、统计按它区分不同目录中的同名插件
+        self.args = tuple(signature[0])  # 所有参数名，用于错误信息
+        self.required = self.args[:signature[1]]  # 必须提供的参数
+        self.optional = self.args[signature[1]:]  # 有默认值的参数，参数集中有真值时才覆盖默认值
+    
+    # 根据参数集生成调用参数
+    def bind(self, param):
+        listParam = []
+        for name in self.required:
+            if name not in param:
+                raise ValueError("func %s%s param %s not provide" % (self.name, self.args, name))
+            listParam.append(param[name])
+        dictParam = {}
+        for name in self.optional:
+            if param.get(name):
+                dictParam[name] = param[name]
+        return listParam, dictParam
+    
+    def __call__(self, param):
+        # 函数没有参数.则直接执行
+        if not self.args:
+            return self.func()
+        listParam, dictParam = self.bind(param)
+        return self.func(*listParam, **dictParam)
 
 
 # 中间件
 class Middleware(object):
     
-    def __init__(self, logger=logging):
+    def __init__(self, logger=logging, lazy=False, manifestDir=None, metrics=None, guard=None, background=False,
+                 parallel=False):
+        """入参：
+            lazy: 是否延迟导入插件。开启后查找插件时只记录路径和md5，插件第一次执行时才导入，
+                  funcCallChain不会导入任何插件
+            manifestDir: 插件查找结果清单的存放目录。重启后清单仍有效时跳过目录遍历、md5计算和签名解析
+            metrics: metrics.Metrics实例，用于统计插件、主函数、调用链及插件加载的耗时，为None时不统计
+            guard: guard.Guard实例，用于插件及调用链超时、周期时间预算和插件熔断，为None时不限制
+            background: 是否在后台线程中重载插件。开启后process、funcCallChain不再等待插件查找和导入，
+                        只触发一次后台重载并使用当前的调用链快照，重载完成后整体替换快照
+            parallel: 是否按插件声明的依赖关系和优先级（PRIORITY、DEPENDS）划分阶段，
+                      同一阶段的插件并行执行，见schedule模块。同时开启lazy时funcCallChain返回插件注册表中的顺序
+        """
         self.logger = logger
+        self.metrics = metrics
+        self.guard = guard
+        self.lazy = lazy
+        self.manifestDir = manifestDir
+        if manifestDir and not os.path.isdir(manifestDir):
+            os.makedirs(manifestDir)
         self.funcList = []  # 要执行的方法列表。示例：[funcA, funcB]
         self.funcParam = {}  # 存放主函数执行过程所需参数。示例：{funcA:{"task":1, "taskPolicy":2}}
-        self.plugin = {}  # 方法要执行的插件列表。示例：{funcA:{"before":[pluginA, pluginB], "after":[pluginC]}
+        self.snapshot = None  # 当前的调用链快照，plugin为其中的插件注册表。示例：{funcA:{"before":PluginRegistry([pluginA, pluginB]), "after":PluginRegistry([pluginC])}
         self.pluginParam = {}  # 各插件相关信息。示例: {funcA:{"before":[{"pluginDir":"dirA", "loop":False}, {"pluginDir":"dirB","loop":True}]}}
         self.pluginExecParam = {}  # 插件执行过程所需参数集。示例：{"task":1, "taskPolicy":2}
+        self.loaders = {}  # 常驻的插件加载器，跨周期保留以便增量加载，同一目录的各挂载点共用。示例：{("dirA", False): loaderObj}
+        self.binders = {}  # 主函数及插件run方法的参数绑定器。示例：{funcA: binderA}
+        self.caches = {}  # 插件run方法的结果缓存，未声明CACHE的插件为None。示例：{run: memo.PluginCache}
+        self.parallel = parallel
+        self.stages = weakref.WeakKeyDictionary()  # 各插件注册表的执行阶段，随调用链快照释放。示例：{plugins: [[pluginA], [pluginB, pluginC]]}
+        self.watcher = None  # 插件目录监听器，调用watch()后启用
+        self.lock = threading.RLock()  # 插件重载锁，监听线程、后台重载线程与主线程都会重载插件
+        self.background = background
+        self.reloader = None  # 后台重载线程，第一次请求重载时启动
+        self.reloadCond = threading.Condition()
+        self.reloadRequested = 0  # 已请求的重载序号
+        self.reloadDone = 0  # 已完成（无论成功与否）的重载序号
+        self.reloadError = None  # 最近一次重载的异常，成功时为None
+        self.loadErrors = {}  # 最近一次加载失败的插件目录，加载成功后移除。示例：{"dirA": exception}
     
     # 在方法列表末尾添加新的对象
     def funcAppend(self, func):
@@ -30,6 +157,7 @@ class Middleware(object):
             raise TypeError("func must be callable")
         if func not in set(self.funcList):
             self.funcList.append(func)
+            self.binders[func] = Binder(func)
     
     # 从方法列表中找出某个值第一个匹配项的索引位置
     def funcIndex(self, func):
@@ -43,16 +171,32 @@ class Middleware(object):
             raise TypeError("func must be callable")
         if func not in set(self.funcList):
             self.funcList.insert(index, func)
+            self.binders[func] = Binder(func)
     
     # 移除方法列表中的一个元素（默认最后一个元素），并且返回该元素的值
     def funcPop(self, index=-1):
-        return self.funcList.pop(index)
+        func = self.funcList.pop(index)
+        self.binders.pop(func, None)
+        return func
     
     # 移除列表中某个值的第一个匹配项
     def funcRemove(self, func):
         if not isfunction(func):
             raise TypeError("func must be callable")
         self.funcList.remove(func)
+        self.binders.pop(func, None)
+    
+    # 当前调用链快照中各主函数的插件注册表
+    @property
+    def plugin(self):
+        snapshot = self.snapshot
+        return snapshot.plugin if snapshot is not None else {}
+    
+    # 当前调用链快照的代数，尚未加载时为0
+    @property
+    def generation(self):
+        snapshot = self.snapshot
+        return snapshot.generation if snapshot is not None else 0
     
     # 返回方法名称列表
     @property
@@ -169,21 +313,225 @@ class Middleware(object):
                         ]
                     }
         }
+        每个插件目录（pluginDir, loop）对应一个常驻的加载器，挂载到多个函数或位置时共用，每次更新只查找、导入一次，
+        且只重新导入新增或有变化的插件。开启监听后，只有监听到变化的插件目录才会重新查找
+        新的调用链快照构建完成后才整体替换，调用链没有变化时保留原快照；重载失败时抛出异常，保留上一代快照。
+        单个插件目录加载失败时只保留该目录上一代的插件，其他目录照常更新；已删除的插件目录视为没有插件
+        返回：当前的调用链快照
+        """
+        with self.lock:
+            # 先同步监听目录再加载，避免加载过程中的变化被遗漏
+            if self.watcher:
+                roots = {}
+                for param in self.pluginParam.values():
+                    for dirInfo in param.values():
+                        for d in dirInfo:
+                            roots[d["pluginDir"]] = bool(roots.get(d["pluginDir"]) or d["loop"])
+                self.watcher.sync(roots)
+            loaders = {}
+            plugin = {}
+            version = []
+            for funcName, param in self.pluginParam.items():
+                pluginsInfo = {}
+                plugin[funcName] = pluginsInfo
+                for position, dirInfo in param.items():
+                    plugins = PluginRegistry()
+                    pluginsInfo[position] = plugins
+                    for d in dirInfo:
+                        key = (d["pluginDir"], d["loop"])
+                        loaderObj = loaders.get(key)
+                        if loaderObj is None:
+                            loaderObj = self.loaders.get(key) or loader.PluginLoader(
+                                lazy=self.lazy, logger=self.logger, manifest=self.manifestPath(*key),
+                                metrics=self.metrics)
+                            if not self.watcher or loaderObj.stale:
+                                self.loadDir(loaderObj, key)
+                            loaders[key] = loaderObj
+                        plugins.extend(loaderObj.plugins)
+                        version.append((funcName, position, key, loaderObj.generation))
+            # 已删除插件目录对应的加载器随之释放，其插件模块移出sys.modules
+            for key, loaderObj in self.loaders.items():
+                if loaders.get(key) is not loaderObj:
+                    loaderObj.unload()
+            self.loaders = loaders
+            previous = self.snapshot
+            if previous is not None and previous.version == version:
+                return previous
+            self.snapshot = ChainSnapshot(plugin, previous.generation + 1 if previous else 1, version)
+            self.updateBinders()
+            return self.snapshot
+    
+    # 获取本次执行使用的调用链快照
+    def refresh(self):
+        """未开启后台重载时先同步重载；开启后只触发后台重载，直接返回当前快照（尚未加载过时等待第一次加载完成）。
+        重载失败时记录日志并继续使用上一代快照，从未加载成功时抛出异常
+        """
+        if self.background and self.snapshot is not None:
+            self.requestReload()
+        elif not self.reload(wait=True) and self.snapshot is None:
+            raise self.reloadError
+        return self.snapshot
+    
+    # 请求一次后台重载，返回重载序号
+    def requestReload(self):
+        with self.reloadCond:
+            self.reloadRequested += 1
+            if self.reloader is None or not self.reloader.is_alive():
+                self.reloader = threading.Thread(target=self.runReloader, name="plugin-reloader")
+                self.reloader.daemon = True
+                self.reloader.start()
+            self.reloadCond.notify_all()
+            return self.reloadRequested
+    
+    # 后台重载线程：合并执行期间收到的重载请求
+    def runReloader(self):
+        while True:
+            with self.reloadCond:
+                while self.reloadDone >= self.reloadRequested:
+                    self.reloadCond.wait()
+                target = self.reloadRequested
+            error = None
+            try:
+                self.updatePlugin()
+            except Exception as e:
+                error = e
+                self.logger.exception("reload plugins failed, keep generation %s: %s" % (self.generation, e))
+            with self.reloadCond:
+                self.reloadError = error
+                self.reloadDone = target
+                self.reloadCond.notify_all()
+    
+    # 加载单个插件目录。加载失败时保留该目录上一代的插件，不影响其他目录，异常记录在loadErrors中
+    def loadDir(self, loaderObj, key):
+        try:
+            loaderObj.loadPlugins(pluginDir=key[0], loop=key[1])
+        except Exception as e:
+            self.loadErrors[key[0]] = e
+            self.logger.exception("load plugin dir %s failed, keep generation %s: %s" % (
+                key[0], loaderObj.generation, e))
+            return
+        self.loadErrors.pop(key[0], None)
+    
+    # 强制重载插件
+    def reload(self, wait=True, timeout=None):
+        """入参：
+            wait: 是否等待重载完成。未开启后台重载时总是同步重载
+            timeout: 等待的超时时间（秒），None为一直等待
+        返回：重载已完成且成功时返回True
+        """
+        if not self.background:
+            try:
+                self.updatePlugin()
+            except Exception as e:
+                self.reloadError = e
+                self.logger.exception("reload plugins failed, keep generation %s: %s" % (self.generation, e))
+                return False
+            self.reloadError = None
+            return True
+        ticket = self.requestReload()
+        if not wait:
+            return False
+        return self.waitReload(ticket, timeout)
+    
+    # 等待后台重载完成
+    def waitReload(self, ticket=None, timeout=None):
+        """入参：
+            ticket: requestReload返回的重载序号，默认为已请求的最后一次
+            timeout: 等待的超时时间（秒），None为一直等待
+        返回：重载已完成且成功时返回True
+        """
+        deadline = None if timeout is None else timer() + timeout
+        with self.reloadCond:
+            if ticket is None:
+                ticket = self.reloadRequested
+            while self.reloadDone < ticket:
+                remaining = None if deadline is None else deadline - timer()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.reloadCond.wait(remaining)
+            return self.reloadError is None
+    
+    # 更新参数绑定器。只为新注册的函数和新导入的插件解析签名，已卸载插件的绑定器随之释放
+    def updateBinders(self):
+        binders = {}
+        for func in self.funcList:
+            binders[func] = self.binders.get(func) or Binder(func)
+        for pluginsInfo in self.plugin.values():
+            for plugins in pluginsInfo.values():
+                for p in plugins:
+                    # 延迟导入的插件在第一次执行时才生成绑定器
+                    if not p.loaded:
+                        continue
+                    method = getattr(p.module, "run", None)
+                    if isfunction(method) and method not in binders:
+                        binders[method] = self.binders.get(method) or Binder(method, p.signature)
+        # 重新导入的插件是新的run方法，旧缓存随之释放
+        self.caches = dict((method, self.caches[method]) for method in binders if method in self.caches)
+        self.binders = binders
+    
+    # 插件run方法的结果缓存，第一次执行时根据插件模块的CACHE声明创建；未声明时返回None
+    def pluginCache(self, method, binder):
+        try:
+            return self.caches[method]
+        except KeyError:
+            cache = self.caches[method] = memo.fromPlugin(method, binder, self.logger)
+            return cache
+    
+    # 各插件的缓存统计，以插件模块的命名空间key区分不同目录中的同名插件
+    # 示例：{"simple_plugin_1a2b3c4d_00_func": {"hits": 10, "misses": 2, "size": 2, "maxSize": 128, "ttl": 60}}
+    def cacheStats(self):
+        return dict((method.__module__, cache.stats()) for method, cache in list(self.caches.items())
+                    if cache is not None)
+    
+    # 各插件目录已导入且尚未释放的插件模块统计，插件代数对应加载器的generation
+    def moduleStats(self):
+        """返回示例：{"./plugins/": {"imported": 12, "released": 2, "generations": {3: {"modules": 10, "bytes": 52000}}}}
+        递归加载（loop=True）的目录key为"目录 (loop)"
+        """
+        return dict(("%s (loop)" % key[0] if key[1] else key[0], loaderObj.modules.stats())
+                    for key, loaderObj in list(self.loaders.items()))
+    
+    # 插件目录对应的查找结果清单路径，未设置manifestDir时返回None
+    def manifestPath(self, pluginDir, loop):
+        if not self.manifestDir:
+            return None
+        key = "%s|%s" % (os.path.abspath(pluginDir), bool(loop))
+        return os.path.join(self.manifestDir, "%s.json" % hashlib.md5(key.encode("utf-8")).hexdigest())
+    
+    # 插件目录变化回调：只标记受影响的加载器，并立即增量重载
+    def onPluginChange(self, changes):
+        with self.lock:
+            for key, loaderObj in self.loaders.items():
+                if key[0] in changes:
+                    loaderObj.invalidate(changes[key[0]])
+            self.updatePlugin()
+        self.logger.info("plugins reloaded, changed: %s" % sorted(changes))
+    
+    # 监听插件目录，插件有变化时立即在后台增量重载，不再需要每个周期重新查找插件
+    def watch(self, delay=0.05, interval=1):
+        """入参：
+            delay: 事件合并的时间窗口（秒），窗口内的多次变化只重载一次
+            interval: inotify不可用时的轮询间隔（秒）
         """
-        for funcName, param in self.pluginParam.items():
-            pluginsInfo = {}
-            self.plugin[funcName] = pluginsInfo
-            for position, dirInfo in param.items():
-                plugins = []
-                pluginsInfo[position] = plugins
-                for d in dirInfo:
-                    loaderObj = loader.PluginLoader()
-                    loaderObj.loadPlugins(pluginDir=d["pluginDir"], loop=d["loop"])
-                    plugins.extend(loaderObj.plugins)
+        with self.lock:
+            if self.watcher:
+                return
+            self.watcher = watcher.PluginWatcher(self.onPluginChange, delay=delay, interval=interval,
+                                                 logger=self.logger)
+            self.watcher.start()
+            self.updatePlugin()
+    
+    # 停止监听插件目录，恢复为每个周期重新查找插件
+    def unwatch(self):
+        with self.lock:
+            if not self.watcher:
+                return
+            self.watcher.stop()
+            self.watcher = None
     
     # 返回函数调用链
     def funcCallChain(self, func=None):
-        self.updatePlugin()  # 更新插件
+        snapshot = self.refresh()  # 更新插件
         callChain = []
         # 获取函数名
         if not func:
@@ -194,85 +542,348 @@ class Middleware(object):
         # 查询调用链
         if funcName not in self.funcNameList:
             return callChain
-        callChain.extend([i.keys()[0] for i in self.plugin[funcName].get("before", []) if i])
+        plugins = snapshot.plugin.get(funcName, {})
+        callChain.extend(self.pluginNames(plugins.get("before")))
         callChain.append(funcName)
-        callChain.extend([i.keys()[0] for i in self.plugin[funcName].get("after", []) if i])
+        callChain.extend(self.pluginNames(plugins.get("after")))
         return callChain
     
-    # 函数执行。跟参数进行绑定，然后执行
-    def callFunc(self, func, plugin=False):
-        # 函数签名
-        signature = getargspec(func)
-        lp, dp = copy.deepcopy(signature[0]), copy.deepcopy(signature[3])
-        # 函数没有参数.则直接执行
-        if len(signature[0]) == 0:
-            return func()
+    # 插件的执行顺序，按阶段执行时为各阶段依次展开
+    def pluginNames(self, plugins):
+        if not plugins:
+            return []
+        # 延迟导入时划分阶段需要导入插件，只返回插件注册表中的顺序
+        if not self.parallel or self.lazy:
+            return plugins.names
+        return [p.name for stage in self.pluginStages(plugins) for p in stage]
+    
+    # 插件注册表的执行阶段，每代调用链快照只划分一次
+    def pluginStages(self, plugins):
+        stages = self.stages.get(plugins)
+        if stages is None:
+            stages = self.stages[plugins] = schedule.buildStages(plugins, self.logger)
+        return stages
+    
+    # 函数执行。使用预先解析的绑定器跟参数进行绑定，然后执行；deadline为调用链的截止时间
+    def callFunc(self, func, plugin=False, deadline=None):
+        binder = self.binders.get(func)
+        if binder is None:
+            binder = self.binders[func] = Binder(func)
         # 获取对应参数
-        funcName = func.__name__
         if not plugin:
-            param = self.funcParam.get(funcName, {})
-        else:
-            param = self.pluginExecParam
-        # 组织相应参数
-        dpLen = len(dp) if dp else 0
-        listParamName = lp[:len(lp) - dpLen]
-        if dp:
-            dictParam = dict(zip(lp[-dpLen:], dp))
+            param = self.funcParam.get(binder.name, {})
+            if self.guard is None:
+                return self.callBinder(binder, param)
+            try:
+                return self.guard.callFunc(binder.name, self.callBinder, (binder, param), deadline)
+            except PluginTimeout as e:
+                self.logger.warning("func %s" % e)
+                return errorResult(e)
+        param = self.pluginExecParam
+        # 声明了CACHE的插件先查找缓存
+        cache = self.pluginCache(func, binder)
+        key = None
+        if cache is not None:
+            key = cache.key(param)
+            hit, rst = cache.get(key)
+            if hit:
+                return rst
+        if self.guard is None:
+            return self.callBinder(binder, param, True, cache, key)
+        return self.guard.callPlugin(binder.pluginName, self.callBinder, (binder, param, True, cache, key), deadline,
+                                     binder.pluginKey)
+    
+    # 通过绑定器执行函数，开启统计时记录耗时；传入cache时缓存执行结果
+    def callBinder(self, binder, param, plugin=False, cache=None, key=None):
+        if self.metrics is None:
+            rst = binder(param)
+        elif plugin:
+            rst = self.metrics.observe("plugin", binder.pluginKey, binder, (param,), pluginStopped)
         else:
-            dictParam = {}
-        # 获取*args参数
-        listParam = [param.get(i, "tvmFlag") for i in listParamName]
-        # 更新**kwargs参数
-        tDParam = copy.deepcopy(dictParam)
-        for i in tDParam:
-            if param.get(i):
-                dictParam[i] = param[i]
-        # 对参数进行判断
-        if len(listParam) == 0 and len(dictParam) == 0:
-            raise ValueError("func %s%s need %s param, 0 provide" % (funcName, tuple(lp), len(lp)))
-        elif "tvmFlag" in listParam:
-            raise ValueError("func %s%s param %s not provide" % (
-                funcName, tuple(lp), lp[listParam.index("tvmFlag")]))
-        elif "tvmFlag" in dictParam.values():
-            tParam = None
-            for k, v in dictParam.items():
-                if "tvmFlag" == v:
-                    tParam = k
-                    break
-            raise ValueError("func %s%s's %s param not provide" % (funcName, tuple(signature[0]), tParam))
-        return func(*listParam, **dictParam)
+            rst = self.metrics.observe("func", binder.name, binder, (param,), funcFailed)
+        if cache is not None:
+            cache.set(key, rst)
+        return rst
+    
+    # 执行单个主函数的调用链：函数前插件 -> 主函数 -> 函数后插件
+    def runChain(self, func, deadline=None, snapshot=None):
+        """返回主函数的执行结果；没有插件或被函数前插件中断时返回None
+        入参：
+            deadline: 本周期的截止时间，开启执行保护时调用链的截止时间不会晚于它
+            snapshot: 使用的调用链快照，默认为当前快照
+        """
+        if self.guard is not None:
+            deadline = self.guard.chainDeadline(deadline)
+        if self.metrics is None:
+            return self.execChain(func, deadline, snapshot)
+        return self.metrics.observe("chain", func.__name__, self.execChain, (func, deadline, snapshot), chainStopped)
+    
+    # 执行调用链。超过截止时间时不再执行后续插件，与插件返回假值一致
+    def execChain(self, func, deadline=None, snapshot=None):
+        plugins = (snapshot.plugin if snapshot is not None else self.plugin).get(func.__name__)
+        if not plugins:
+            return None
+        # 函数前插件
+        if not self.runPlugins(func, plugins.get("before"), deadline):
+            return None
+        # 执行主函数
+        rst = self.callFunc(func, deadline=deadline)
+        if rst["errCode"] != 0:
+            return rst
+        # 函数后插件
+        self.runPlugins(func, plugins.get("after"), deadline)
+        return rst
+    
+    # 执行插件列表，返回False表示有插件返回假值或超过截止时间，需要中断调用链
+    def runPlugins(self, func, plugins, deadline=None):
+        if not plugins:
+            return True
+        if not self.parallel:
+            for p in plugins:
+                if self.chainExpired(func, deadline):
+                    return False
+                method = getattr(p.module, "run", None)
+                if isfunction(method) and not self.callFunc(method, plugin=True, deadline=deadline):
+                    return False
+            return True
+        # 按阶段执行，同一阶段的插件并行执行，有插件返回假值时不再执行后续阶段
+        for stage in self.pluginStages(plugins):
+            if self.chainExpired(func, deadline):
+                return False
+            if len(stage) == 1:
+                results = [self.callFunc(stage[0].module.run, plugin=True, deadline=deadline)]
+            else:
+                pool = schedule.stagePool()
+                tasks = [pool.apply_async(self.callFunc, (p.module.run, True, deadline)) for p in stage]
+                results = [task.get() for task in tasks]
+            if not all(results):
+                return False
+        return True
+    
+    # 调用链是否已超过截止时间
+    def chainExpired(self, func, deadline):
+        if self.guard is None or not self.guard.expired(deadline):
+            return False
+        self.logger.warning("func %s call chain deadline exceeded" % func.__name__)
+        return True
+    
+    # 执行调用链，异常转换为错误结果，用于并发执行
+    def safeRunChain(self, func, deadline=None, snapshot=None):
+        try:
+            return self.runChain(func, deadline, snapshot)
+        except Exception as e:
+            self.logger.exception("func %s call chain failed: %s" % (func.__name__, e))
+            return errorResult(e)
     
     # 执行函数
-    def process(self):
-        self.updatePlugin()  # 更新插件
-        for func in self.funcList:
-            funcName = func.__name__
-            plugins = self.plugin.get(funcName)
-            if not plugins:
+    def process(self, executor=None, maxWorkers=None):
+        """主函数之间互相隔离，主函数返回的errCode不为0时只跳过自身的函数后插件
+        入参：
+            executor: 并发执行方式。None为顺序执行；"thread"为线程池；"process"为进程池；
+                      也可以传入已创建的ThreadPool或常驻工作进程池workers.WorkerPool，由调用方负责关闭
+            maxWorkers: 新建线程池或进程池的大小，默认为主函数个数
+        返回：各主函数的执行结果。示例：{"funcA": {"errCode": 0, "errMsg": "success"}, "funcB": None}
+            并发执行时各调用链的异常不会抛出，记为{"errCode": -1, "errMsg": 异常信息}
+            开启执行保护时，周期时间预算用完后尚未开始的调用链记为{"errCode": -1, "errMsg": "PluginTimeout: ..."}
+        执行期间插件重载不影响本次执行，各调用链都使用开始时的调用链快照
+        """
+        snapshot = self.refresh()  # 更新插件
+        funcList = list(self.funcList)
+        results = {}
+        deadline = self.guard.cycleDeadline() if self.guard is not None else None
+        if not executor:
+            for func in funcList:
+                if self.guard is not None and self.guard.expired(deadline):
+                    results[func.__name__] = self.budgetExhausted(func)
+                else:
+                    results[func.__name__] = self.runChain(func, deadline, snapshot)
+            return results
+        # 常驻工作进程池
+        if hasattr(executor, "runChains"):
+            return executor.runChains(funcList, deadline, snapshot)
+        if executor not in ("thread", "process") and not hasattr(executor, "apply_async"):
+            raise ValueError("executor must be none, 'thread', 'process' or a pool")
+        if executor == "process" and _forkContext is None:
+            raise ValueError("executor 'process' requires the fork start method, which is unavailable here")
+        maxWorkers = maxWorkers or max(len(funcList), 1)
+        pool = executor
+        if executor == "thread":
+            pool = ThreadPool(maxWorkers)
+        elif executor == "process":
+            global _forked
+            with _forkLock:
+                _forked = (self, snapshot)
+                try:
+                    pool = _forkContext.Pool(maxWorkers)
+                finally:
+                    _forked = None
+        overrun = False
+        try:
+            if executor == "process":
+                tasks = [pool.apply_async(_runForked, (self.funcList.index(func), deadline)) for func in funcList]
+            else:
+                tasks = [pool.apply_async(self.safeRunChain, (func, deadline, snapshot)) for func in funcList]
+            for func, task in zip(funcList, tasks):
+                if deadline is None:
+                    results[func.__name__] = task.get()
+                    continue
+                # 超过周期预算仍未完成的调用链不再等待
+                try:
+                    results[func.__name__] = task.get(max(deadline - timer(), 0))
+                except multiprocessing.TimeoutError:
+                    results[func.__name__] = self.budgetExhausted(func)
+                    overrun = True
+        finally:
+            if pool is not executor:
+                # 有未完成的调用链时直接终止，不等待其结束
+                if overrun:
+                    pool.terminate()
+                else:
+                    pool.close()
+                    pool.join()
+        return results
+    
+    # 周期时间预算用完，调用链记为超时
+    def budgetExhausted(self, func):
+        self.logger.warning("func %s skipped, cycle budget exhausted" % func.__name__)
+        return errorResult(PluginTimeout("cycle budget exhausted"))
+    
+    # 批量执行单个主函数的调用链
+    def processBatch(self, func, paramsIterable, chunkSize=100):
+        """插件只加载一次，调用链按chunkSize分块处理各参数集，每个参数集单独判断是否中断。
+        插件模块定义了runBatch(items)时，整块中未被中断的参数集一次传入，需返回与items等长的结果列表
+        入参：
+            func: 主函数或主函数名
+            paramsIterable: 参数集的可迭代对象。每个参数集同时用于主函数和插件，
+                            覆盖addParam2Func、addParam2Plugin中的同名参数
+            chunkSize: 每块的参数集数量
+        返回：生成器，按输入顺序逐个产出主函数的执行结果；被函数前插件中断时为None，
+            异常记为{"errCode": -1, "errMsg": 异常信息}，runBatch异常时整块都记为异常
+        """
+        func = self.batchFunc(func)
+        plugins = self.refresh().plugin.get(func.__name__)  # 更新插件
+        binder, before, after = self.batchContext(func, plugins)
+        chunk = []
+        for item in paramsIterable:
+            chunk.append(item)
+            if len(chunk) < chunkSize:
                 continue
-            # 提权函数执行前后插件
-            beforePlugins = plugins.get("before", [])
-            afterPlugins = plugins.get("after", [])
-            # 函数前插件
-            flag = True  # 标识插件是否继续执行
-            for p in beforePlugins:
-                n, m = p.items()[0]
-                method = getattr(m["module"], "run", None)
-                if isfunction(method):
-                    flag = self.callFunc(method, plugin=True)
-                    if not flag:
-                        break
-            # 执行主函数
-            if not flag:
-                continue  # 执行下一个主函数
-            rst = self.callFunc(func)
-            if rst["errCode"] != 0:
-                return
-                # 函数后插件
-            for p in afterPlugins:
-                n, m = p.items()[0]
-                method = getattr(m["module"], "run", None)
-                if isfunction(method):
-                    flag = self.callFunc(method, plugin=True)
-                    if not flag:
-                        break
+            for rst in self.runBatchChunk(plugins, binder, before, after, chunk):
+                yield rst
+            chunk = []
+        if chunk:
+            for rst in self.runBatchChunk(plugins, binder, before, after, chunk):
+                yield rst
+    
+    # 使用指定的调用链快照批量执行单个主函数的调用链，不重载插件，用于常驻服务
+    def executeBatch(self, func, items, snapshot=None):
+        """入参与processBatch相同，items为参数集列表，snapshot默认为当前快照
+        返回：与items等长的结果列表
+        """
+        func = self.batchFunc(func)
+        plugins = (snapshot.plugin if snapshot is not None else self.plugin).get(func.__name__)
+        binder, before, after = self.batchContext(func, plugins)
+        return self.runBatchChunk(plugins, binder, before, after, list(items))
+    
+    # 主函数或主函数名对应的主函数，不存在时抛出ValueError
+    def batchFunc(self, func):
+        funcName = func
+        if isfunction(func):
+            funcName = func.__name__
+        if funcName not in self.funcNameList:
+            raise ValueError("%s not in funcList, please add func to middleware first" % funcName)
+        return self.funcList[self.funcNameList.index(funcName)]
+    
+    # 批量执行所需的主函数绑定器及函数前、函数后插件
+    def batchContext(self, func, plugins):
+        binder = self.binders.get(func) or Binder(func)
+        before = self.batchPlugins(plugins.get("before", []) if plugins else [])
+        after = self.batchPlugins(plugins.get("after", []) if plugins else [])
+        return binder, before, after
+    
+    # 获取插件的run、绑定器、runBatch和结果缓存，示例：[(run, binder, runBatch, cache)]
+    def batchPlugins(self, plugins):
+        methods = []
+        for p in plugins:
+            method = getattr(p.module, "run", None)
+            batch = getattr(p.module, "runBatch", None)
+            if not isfunction(batch):
+                batch = None
+            if isfunction(method):
+                binder = self.binders.get(method) or Binder(method)
+                methods.append((method, binder, batch, self.pluginCache(method, binder)))
+            elif batch:
+                methods.append((None, None, batch, None))
+        return methods
+    
+    # 执行一块参数集的调用链
+    def runBatchChunk(self, plugins, binder, before, after, chunk):
+        results = [None] * len(chunk)
+        # 与runChain一致，没有插件的主函数不执行
+        if not plugins:
+            return results
+        funcParam = self.funcParam.get(binder.name, {})
+        pluginParams = []
+        for item in chunk:
+            param = dict(self.pluginExecParam)
+            param.update(item)
+            pluginParams.append(param)
+        alive = list(range(len(chunk)))  # 未被中断的参数集下标
+        for plugin in before:
+            alive = self.runBatchPlugin(plugin, alive, pluginParams, results)
+        for i in alive:
+            param = dict(funcParam)
+            param.update(chunk[i])
+            try:
+                results[i] = self.callBinder(binder, param)
+            except Exception as e:
+                results[i] = errorResult(e)
+        alive = [i for i in alive if results[i]["errCode"] == 0]
+        for plugin in after:
+            alive = self.runBatchPlugin(plugin, alive, pluginParams, results)
+        return results
+    
+    # 对未被中断的参数集执行插件，返回插件结果为真的参数集下标
+    def runBatchPlugin(self, plugin, alive, pluginParams, results):
+        method, binder, batch, cache = plugin
+        if not alive:
+            return alive
+        if batch:
+            try:
+                items = [pluginParams[i] for i in alive]
+                if self.metrics is None:
+                    flags = batch(items)
+                else:
+                    flags = self.metrics.observe("plugin", batch.__module__, batch, (items,))
+                if len(flags) != len(alive):
+                    raise ValueError("runBatch must return %s results, %s returned" % (len(alive), len(flags)))
+            except Exception as e:
+                self.logger.exception("plugin runBatch failed: %s" % e)
+                for i in alive:
+                    results[i] = errorResult(e)
+                return []
+        else:
+            flags = []
+            for i in alive:
+                try:
+                    hit, key = False, None
+                    if cache is not None:
+                        key = cache.key(pluginParams[i])
+                        hit, rst = cache.get(key)
+                    if not hit:
+                        rst = self.callBinder(binder, pluginParams[i], True, cache, key)
+                    flags.append(rst)
+                except Exception as e:
+                    results[i] = errorResult(e)
+                    flags.append(False)
+        return [i for i, flag in zip(alive, flags) if flag]
+    
+    # 基于asyncio并发执行各主函数的调用链，返回协程（需要Python 3.7+）
+    def aprocess(self, concurrency=100):
+        """插件的run和主函数可以是async def，普通函数在事件循环默认的executor中执行
+        入参：
+            concurrency: 同时执行的调用链数量上限
+        返回：与process相同，各调用链的异常记为{"errCode": -1, "errMsg": 异常信息}
+        """
+        from . import aio
+        return aio.process(self, concurrency=concurrency)
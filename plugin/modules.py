@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+
+"""
+插件模块的命名空间及内存回收
+    1. 插件以simple_plugin_<插件所在目录路径md5的前8位>_<插件名称>为key导入并注册到sys.modules，
+       不同目录中的同名插件互不覆盖
+    2. 插件变化后重新导入时创建新的模块对象，不在旧模块中重新执行，执行中的调用链继续使用旧快照中的旧模块
+    3. 插件变化或删除后，旧模块从sys.modules中移除，不再被任何调用链快照引用时随插件记录一起释放，
+       模块中函数与模块字典的循环引用由垃圾回收处理
+    4. ModuleTracker按插件代数统计尚未释放的模块数量及估算的内存
+PS:
+    1. 插件中定义的函数__module__为命名空间key，统计、熔断、缓存按它区分不同目录中的同名插件；
+       pluginName获取的插件名称用于调用链、日志及pluginTimeouts配置
+    2. 估算的内存只包括模块字典及其中的函数、代码对象、常量等直接持有的对象，不包括插件导入的其他模块
+    3. 旧模块释放后，仍在执行的旧函数（例如超时后在后台继续执行的插件）在Python 3中可以继续访问模块中的全局变量；
+       Python 2释放模块对象时会清空模块字典
+"""
+
+import os
+import re
+import sys
+import imp
+import hashlib
+import threading
+import weakref
+from types import FunctionType, ModuleType
+
+MODULE_PREFIX = "simple_plugin_"  # 插件模块在sys.modules中的key前缀
+_moduleKey = re.compile(r"^%s[0-9a-f]{8}_(.+)$" % MODULE_PREFIX)
+
+
+# 插件模块在sys.modules中的key，由插件所在目录和插件名称决定
+def moduleKey(name, path):
+    pluginDir = os.path.realpath(os.path.dirname(path))
+    if not isinstance(pluginDir, bytes):
+        pluginDir = pluginDir.encode("utf-8")
+    return "%s%s_%s" % (MODULE_PREFIX, hashlib.md5(pluginDir).hexdigest()[:8], name)
+
+
+# 函数所属的插件名称，不是插件中定义的函数时返回其模块名
+def pluginName(func):
+    match = _moduleKey.match(func.__module__ or "")
+    return match.group(1) if match else func.__module__
+
+
+# 导入插件，总是创建新的模块对象
+def importModule(name, path, info=None, register=True):
+    """入参：
+        name: 插件名称
+        path: 插件文件路径
+        info: imp.find_module的结果，为None时在插件所在目录中查找
+        register: 是否保留在sys.modules中。为False时（例如导入已被替换的旧插件）或导入失败时恢复sys.modules中原有的模块
+    """
+    key = moduleKey(name, path)
+    if info is None:
+        info = imp.find_module(name, [os.path.dirname(path)])
+    previous = sys.modules.pop(key, None)
+    module = None
+    try:
+        module = imp.load_module(key, *info)
+        return module
+    finally:
+        if info[0]:
+            info[0].close()
+        if not register or module is None:
+            sys.modules.pop(key, None)
+            if previous is not None:
+                sys.modules[key] = previous
+
+
+# 从sys.modules中移除插件记录的模块，sys.modules中已是其他模块时不处理
+def evictModule(record):
+    module = record._module
+    if module is not None and sys.modules.get(module.__name__) is module:
+        del sys.modules[module.__name__]
+
+
+# 估算模块占用的内存（字节）
+def moduleSize(module):
+    seen = set()
+    size = sys.getsizeof(vars(module))
+    objects = [value for name, value in vars(module).items() if name != "__builtins__"]
+    while objects:
+        obj = objects.pop()
+        if id(obj) in seen or isinstance(obj, ModuleType):
+            continue
+        # 从其他模块导入的函数和类不计入
+        if isinstance(obj, (FunctionType, type)) and obj.__module__ != module.__name__:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            objects.extend(obj.values())
+        elif isinstance(obj, FunctionType):
+            objects.append(obj.__code__)
+            objects.extend(obj.__defaults__ or ())
+        elif isinstance(obj, type(moduleSize.__code__)):
+            objects.append(obj.co_code)
+            objects.extend(obj.co_consts)
+        elif isinstance(obj, type):
+            objects.append(obj.__dict__.copy())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            objects.extend(obj)
+    return size
+
+
+class ModuleTracker(object):
+    """统计加载器导入的插件模块，插件记录释放后随之移除"""
+
+    def __init__(self):
+        self.live = {}  # 尚未释放的插件记录。示例：{weakref(record): (插件代数, 估算内存)}
+        self.imported = 0  # 导入的模块数
+        self.released = 0  # 已释放的模块数
+        self.lock = threading.RLock()  # 释放回调可能在持有锁时由垃圾回收触发
+
+    # 记录已导入的插件
+    def track(self, record):
+        size = moduleSize(record._module)
+        with self.lock:
+            self.live[weakref.ref(record, self.release)] = (record.generation, size)
+            self.imported += 1
+
+    # 插件记录已释放
+    def release(self, ref):
+        with self.lock:
+            if self.live.pop(ref, None) is not None:
+                self.released += 1
+
+    # 统计。示例：{"imported": 12, "released": 2, "generations": {3: {"modules": 10, "bytes": 52000}}}
+    def stats(self):
+        with self.lock:
+            generations = {}
+            for generation, size in list(self.live.values()):
+                stat = generations.setdefault(generation, {"modules": 0, "bytes": 0})
+                stat["modules"] += 1
+                stat["bytes"] += size
+            return {"imported": self.imported, "released": self.released, "generations": generations}
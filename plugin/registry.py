@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+
+"""
+有序插件注册表，用于替代存放单key字典的插件列表
+按插件名称查找、插入、删除都是O(1)，遍历顺序即插件加入的顺序（插件执行顺序）
+"""
+
+from collections import OrderedDict
+
+
+class PluginRecord(object):
+    """插件信息。延迟导入时module在第一次访问时才由importer导入"""
+    __slots__ = ("name", "_module", "md5", "path", "importer", "signature", "generation", "__weakref__")
+
+    def __init__(self, name, module=None, md5=None, path=None, importer=None, signature=None, generation=None):
+        self.name = name  # 插件名称
+        self._module = module  # 导入的模块
+        self.md5 = md5  # 插件文件的md5
+        self.path = path  # 插件文件路径
+        self.importer = importer  # 导入函数importer(record)，导入完成（无论成功与否）后置为None
+        self.signature = signature  # run方法的签名：(参数名列表, 必须提供的参数个数)
+        self.generation = generation  # 创建该记录时加载器的插件代数
+
+    def __repr__(self):
+        return "<PluginRecord %s %s>" % (self.name, self.path)
+
+    # 导入的模块，尚未导入时先导入；导入失败时为None
+    @property
+    def module(self):
+        importer = self.importer
+        if importer is not None:
+            importer(self)
+        return self._module
+
+    # 是否已导入
+    @property
+    def loaded(self):
+        return self.importer is None
+
+
+class PluginRegistry(object):
+    """有序插件注册表。同名插件只保留一个，替换已有插件时保持其原有位置"""
+
+    def __init__(self, records=(), generation=0):
+        self.records = OrderedDict()  # 示例：{"00_func": record}
+        self.generation = generation  # 插件代数，插件有新增、更新或删除时加1
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __contains__(self, name):
+        return name in self.records
+
+    # 插件名称列表
+    @property
+    def names(self):
+        return list(self.records)
+
+    # 按名称获取插件，不存在时返回default
+    def get(self, name, default=None):
+        return self.records.get(name, default)
+
+    # 添加插件，同名插件已存在时原位替换
+    def add(self, record):
+        self.records[record.name] = record
+        self.generation += 1
+
+    # 依次添加插件，已存在的同名插件保持不变（与import机制一致，先找到的插件生效）
+    def extend(self, records):
+        for record in records:
+            if record.name not in self.records:
+                self.records[record.name] = record
+
+    # 删除插件，不存在时返回None
+    def remove(self, name):
+        record = self.records.pop(name, None)
+        if record is not None:
+            self.generation += 1
+        return record
+
+
+class ChainSnapshot(object):
+    """函数调用链快照：各主函数的插件注册表。构建完成后不再修改，重载时整体替换，执行中的调用链继续使用旧快照"""
+    __slots__ = ("plugin", "generation", "version")
+
+    def __init__(self, plugin, generation=1, version=None):
+        self.plugin = plugin  # 示例：{"funcA": {"before": PluginRegistry, "after": PluginRegistry}}
+        self.generation = generation  # 快照代数，每次替换加1
+        self.version = version  # 各加载器的插件代数，用于判断重载后调用链是否有变化
+
+    def __repr__(self):
+        return "<ChainSnapshot generation %s>" % self.generation
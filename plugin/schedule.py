@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+
+"""
+插件依赖调度：按依赖关系和优先级把插件列表划分为若干阶段，同一阶段的插件互不依赖，可以并行执行
+插件模块可以声明：
+    PRIORITY = 10  # 优先级，数值小的先执行，同一优先级中没有依赖关系的插件在同一阶段
+    DEPENDS = ["00_func"]  # 依赖的插件名称，被依赖的插件执行完成后才执行；不在同一调用链位置的插件会被忽略
+划分规则：
+    1. 声明了PRIORITY或DEPENDS（包括DEPENDS = []）的插件才参与并行，只等待依赖的插件及优先级更小的插件
+    2. 两者都没有声明的插件保持原有顺序，与前后的插件都不并行，相当于一道屏障；
+       声明了的插件不会越过它们，即只在相邻两个未声明插件之间调度
+    3. PRIORITY不是数值、DEPENDS不是列表时记录警告，视为未声明
+    4. 依赖关系有环（包括依赖屏障之后的插件）时记录错误，该位置的插件按原有顺序逐个执行
+PS:
+    1. 插件名称的NN_前缀不影响阶段划分，插件都没有声明时按原有顺序逐个执行，与不按阶段执行时的顺序一致
+    2. 只有PRIORITY、DEPENDS会改变执行顺序
+"""
+
+import os
+import atexit
+import numbers
+import threading
+from inspect import isfunction
+from multiprocessing.pool import ThreadPool
+
+STAGE_WORKERS = 8  # 并行执行同一阶段插件的线程数
+_stagePool = None  # 执行阶段共用的线程池：(创建线程池的进程号, 线程池)，fork出的子进程中重新创建
+_stagePoolLock = threading.Lock()
+
+
+# 插件声明的优先级，未声明或无效时返回None
+def priority(record, module, logger):
+    value = getattr(module, "PRIORITY", None)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        logger.warning("plugin %s invalid PRIORITY %r, ignored" % (record.name, value))
+        return None
+    return value
+
+
+# 插件声明的依赖，未声明或无效时返回None
+def depends(record, module, logger):
+    value = getattr(module, "DEPENDS", None)
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple, set, frozenset)):
+        logger.warning("plugin %s invalid DEPENDS %r, ignored" % (record.name, value))
+        return None
+    return value
+
+
+# 划分插件执行阶段
+def buildStages(plugins, logger):
+    """入参：
+        plugins: PluginRegistry，只处理有run方法的插件
+    返回：[[record, ...], ...]，阶段内按原有顺序排列
+    """
+    records = [p for p in plugins if isfunction(getattr(p.module, "run", None))]
+    names = set(p.name for p in records)
+    declared = {}  # 声明了优先级或依赖的插件。示例：{"00_func": (10, ["01_func"])}
+    for p in records:
+        value, required = priority(p, p.module, logger), depends(p, p.module, logger)
+        if value is not None or required is not None:
+            declared[p.name] = (value, [name for name in required or () if name in names and name != p.name])
+    # 按未声明的插件分段：[(段前的未声明插件, [段内声明了的插件])]
+    segments = [(None, [])]
+    for p in records:
+        if p.name in declared:
+            segments[-1][1].append(p.name)
+        else:
+            segments.append((p.name, []))
+    # 前驱：未声明的插件等待之前的所有插件；声明了的插件等待依赖的插件、段内优先级更小的插件及段前的未声明插件
+    predecessors = {}
+    previous = (None, [])
+    for barrier, members in segments:
+        if barrier is not None:
+            predecessors[barrier] = set(previous[1]) | (set([previous[0]]) if previous[0] else set())
+        for name in members:
+            value, dependsOn = declared[name]
+            preds = set(dependsOn)
+            if barrier is not None:
+                preds.add(barrier)
+            if value is not None:
+                preds.update(i for i in members if declared[i][0] is not None and declared[i][0] < value)
+            predecessors[name] = preds
+        previous = (barrier, members)
+    ranks = {}
+    visiting = set()
+
+    def rank(name):
+        if name in ranks:
+            return ranks[name]
+        if name in visiting:
+            raise ValueError("plugin depends cycle at %s" % name)
+        visiting.add(name)
+        ranks[name] = max([rank(i) + 1 for i in predecessors[name]] or [0])
+        visiting.discard(name)
+        return ranks[name]
+
+    try:
+        for p in records:
+            rank(p.name)
+    except ValueError as e:
+        logger.error("%s, run plugins %s sequentially" % (e, [p.name for p in records]))
+        return [[p] for p in records]
+    stages = {}
+    for p in records:
+        stages.setdefault(ranks[p.name], []).append(p)
+    return [stages[i] for i in sorted(stages)]
+
+
+# 执行阶段共用的线程池
+def stagePool():
+    global _stagePool
+    with _stagePoolLock:
+        if _stagePool is None or _stagePool[0] != os.getpid():
+            _stagePool = (os.getpid(), ThreadPool(STAGE_WORKERS))
+        return _stagePool[1]
+
+
+# 退出时关闭执行阶段的线程池
+@atexit.register
+def _closeStagePool():
+    if _stagePool is not None and _stagePool[0] == os.getpid():
+        _stagePool[1].terminate()
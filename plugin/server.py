@@ -0,0 +1,345 @@
+# -*- coding:utf-8 -*-
+
+"""
+常驻任务服务：在Unix domain socket上接收任务，放入有界队列，由工作线程使用常驻的中间件执行
+协议：每行一个json
+    请求：{"id": 1, "func": "funcA", "params": {"task": 1}}
+        params同时用于主函数和插件，覆盖addParam2Func、addParam2Plugin中的同名参数（与processBatch一致）
+    响应：{"id": 1, "result": {"errCode": 0, "errMsg": "success"}}
+        result与processBatch的结果一致：被函数前插件中断或主函数没有插件时为null，异常记为{"errCode": -1, "errMsg": 异常信息}
+使用示例：
+    srv = server.JobServer(mid, "/tmp/simple-plugin.sock", workers=4, queueSize=1000)
+    srv.serveForever()
+
+    client = server.Client("/tmp/simple-plugin.sock")
+    client.call("funcA", {"task": 1})
+PS:
+    1. 同一连接可以连续发送多个请求，响应按完成顺序返回，通过id对应
+    2. 队列已满时，读取请求的线程最多等待backpressure秒（此时不再读取该连接的后续请求），
+       仍然已满时返回{"errCode": -1, "errMsg": "ServerBusy: job queue full"}
+    3. 工作线程每次从队列取出最多batchSize个任务，同一主函数的任务通过executeBatch一起执行，
+       插件定义了runBatch时一次处理整批参数集
+    4. 插件按reloadInterval定期在后台重载，任务使用当前的调用链快照，不等待重载
+    5. shutdown时先关闭各连接的读端，已接收的任务执行完并返回结果；之后收到的请求返回
+       {"errCode": -1, "errMsg": "ServerStopped: server is shutting down"}
+"""
+
+import os
+import json
+import stat
+import socket
+import logging
+import threading
+from collections import OrderedDict
+from .metrics import timer
+from .middleware import errorResult
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+
+
+class ServerBusy(Exception):
+    """任务队列已满"""
+
+
+class ServerStopped(Exception):
+    """服务正在停止"""
+
+
+# 编码一行响应，结果无法序列化时返回错误结果
+def encode(jobId, result):
+    try:
+        line = json.dumps({"id": jobId, "result": result})
+    except (TypeError, ValueError) as e:
+        line = json.dumps({"id": jobId, "result": errorResult(e)})
+    return (line + "\n").encode("utf-8")
+
+
+class Channel(object):
+    """客户端连接的响应通道，多个工作线程可能同时返回结果"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.pending = 0  # 尚未返回结果的任务数
+        self.cond = threading.Condition()
+
+    # 登记一个任务
+    def begin(self):
+        with self.cond:
+            self.pending += 1
+
+    # 返回任务结果，客户端已断开时丢弃
+    def reply(self, jobId, result):
+        line = encode(jobId, result)
+        with self.cond:
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except (IOError, OSError, ValueError):
+                pass
+            self.pending -= 1
+            self.cond.notify_all()
+
+    # 等待所有任务返回结果
+    def drain(self):
+        with self.cond:
+            while self.pending:
+                self.cond.wait()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """逐行读取客户端请求并放入任务队列"""
+
+    def handle(self):
+        jobServer = self.server.jobServer
+        channel = Channel(self.wfile)
+        jobServer.connect(self.request)
+        try:
+            for line in iter(self.rfile.readline, b""):
+                if line.strip():
+                    jobServer.submit(line, channel)
+            # 客户端关闭写端后，等待已接收任务的结果返回
+            channel.drain()
+        except (IOError, OSError):
+            pass  # 连接被客户端重置或被shutdown关闭
+        finally:
+            jobServer.disconnect(self.request)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class JobServer(object):
+    """常驻任务服务"""
+
+    def __init__(self, mid, path, workers=4, queueSize=1000, batchSize=32, backpressure=1.0, reloadInterval=10,
+                 logger=logging):
+        """入参：
+            mid: 常驻的中间件实例，主函数及插件目录需提前注册
+            path: Unix domain socket路径，已存在的socket文件会被删除
+            workers: 执行任务的工作线程数
+            queueSize: 任务队列长度
+            batchSize: 工作线程每次最多取出的任务数
+            backpressure: 队列已满时最多等待的时间（秒），None为一直等待
+            reloadInterval: 后台重载插件的间隔（秒），None为不重载（例如已调用mid.watch()）
+        """
+        self.mid = mid
+        self.path = path
+        self.workers = workers
+        self.batchSize = batchSize
+        self.backpressure = backpressure
+        self.reloadInterval = reloadInterval
+        self.logger = logger
+        self.jobs = queue.Queue(queueSize)  # 示例：[(任务id, 主函数名, 参数集, 响应通道, 入队时间)]
+        self.server = None
+        self.threads = []
+        self.connections = set()  # 当前的客户端连接
+        self.connCond = threading.Condition()
+        self.submitting = 0  # 正在放入队列的任务数
+        self.stopped = threading.Event()
+        self.counters = {"accepted": 0, "completed": 0, "rejected": 0, "invalid": 0}
+        self.lock = threading.Lock()
+
+    # 计数
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    # 服务统计。示例：{"accepted": 10, "completed": 9, "rejected": 0, "invalid": 0, "queued": 1}
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["queued"] = self.jobs.qsize()
+        return stats
+
+    # 启动服务，不阻塞
+    def start(self):
+        self.mid.refresh()  # 先加载插件
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.remove(self.path)
+        self.server = UnixServer(self.path, Handler)
+        self.server.jobServer = self
+        targets = [self.server.serve_forever] + [self.work] * self.workers
+        if self.reloadInterval:
+            targets.append(self.reload)
+        for target in targets:
+            thread = threading.Thread(target=target, name="plugin-server")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.logger.info("job server listening on %s, workers: %s" % (self.path, self.workers))
+
+    # 启动服务并阻塞，直到shutdown
+    def serveForever(self):
+        self.start()
+        while not self.stopped.wait(1):
+            pass
+
+    # 停止服务：不再接收新连接和请求，工作线程执行完队列中的任务后退出，再关闭客户端连接
+    def shutdown(self, timeout=5):
+        """入参：
+            timeout: 关闭客户端连接后等待连接处理线程退出的时间（秒）
+        """
+        with self.connCond:
+            if self.stopped.is_set():
+                return
+            self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        # 关闭读端，连接处理线程不再读取请求；等待正在放入队列的任务入队后再放入退出标记
+        with self.connCond:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RD)
+                except (IOError, OSError):
+                    pass
+            while self.submitting:
+                self.connCond.wait()
+        for _ in range(self.workers):
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        with self.connCond:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except (IOError, OSError):
+                    pass
+            deadline = timer() + timeout
+            while self.connections and timer() < deadline:
+                self.connCond.wait(deadline - timer())
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # 登记客户端连接
+    def connect(self, conn):
+        with self.connCond:
+            self.connections.add(conn)
+
+    # 客户端连接处理结束
+    def disconnect(self, conn):
+        with self.connCond:
+            self.connections.discard(conn)
+            self.connCond.notify_all()
+
+    # 解析请求并放入队列，队列已满时等待backpressure秒，服务正在停止时拒绝
+    def submit(self, line, channel):
+        channel.begin()
+        jobId = None
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise TypeError("request must be object")
+            jobId = request.get("id")
+            func = request["func"]
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise TypeError("params must be object")
+        except (ValueError, KeyError, TypeError) as e:
+            self.count("invalid")
+            channel.reply(jobId, errorResult(e))
+            return
+        with self.connCond:
+            stopped = self.stopped.is_set()
+            if not stopped:
+                self.submitting += 1
+        if stopped:
+            self.count("rejected")
+            channel.reply(jobId, errorResult(ServerStopped("server is shutting down")))
+            return
+        try:
+            self.jobs.put((jobId, func, params, channel, timer()), timeout=self.backpressure)
+        except queue.Full:
+            self.count("rejected")
+            channel.reply(jobId, errorResult(ServerBusy("job queue full")))
+            return
+        finally:
+            with self.connCond:
+                self.submitting -= 1
+                self.connCond.notify_all()
+        self.count("accepted")
+
+    # 工作线程：每次取出最多batchSize个任务，同一主函数的任务一起执行
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            while len(batch) < self.batchSize:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None)  # 留给下一次循环退出
+                    break
+                batch.append(job)
+            groups = OrderedDict()
+            for job in batch:
+                groups.setdefault(job[1], []).append(job)
+            snapshot = self.mid.snapshot
+            for func, jobs in groups.items():
+                try:
+                    results = self.mid.executeBatch(func, [job[2] for job in jobs], snapshot)
+                except Exception as e:
+                    results = [errorResult(e)] * len(jobs)
+                for job, rst in zip(jobs, results):
+                    if self.mid.metrics is not None:
+                        self.mid.metrics.record("server", "job", timer() - job[4])
+                    job[3].reply(job[0], rst)
+            self.count("completed", len(batch))
+
+    # 定期在后台重载插件
+    def reload(self):
+        while not self.stopped.wait(self.reloadInterval):
+            self.mid.reload()
+
+
+class Client(object):
+    """任务服务客户端"""
+
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+        self.nextId = 0
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    # 执行单个任务，返回结果
+    def call(self, func, params=None):
+        return self.callMany([(func, params)])[0]
+
+    # 连续发送多个任务后读取结果，返回与jobs顺序一致的结果列表
+    def callMany(self, jobs):
+        """入参：
+            jobs: [(主函数名, 参数集)]
+        """
+        ids = []
+        lines = []
+        for func, params in jobs:
+            self.nextId += 1
+            ids.append(self.nextId)
+            lines.append(json.dumps({"id": self.nextId, "func": func, "params": params or {}}) + "\n")
+        # 在单独的线程中发送，避免服务端反压时双方互相等待
+        sender = threading.Thread(target=self.sock.sendall, args=("".join(lines).encode("utf-8"),))
+        sender.daemon = True
+        sender.start()
+        results = {}
+        while len(results) < len(ids):
+            line = self.rfile.readline()
+            if not line:
+                raise IOError("connection closed by server")
+            response = json.loads(line.decode("utf-8"))
+            results[response["id"]] = response["result"]
+        sender.join()
+        return [results[i] for i in ids]
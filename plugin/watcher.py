@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+该模块用于监听插件目录变化，代替定时重新查找插件
+监听方式有以下两种：
+1. inotify
+    Linux下通过libc的inotify接口监听目录事件，文件变化后毫秒级回调
+2. 轮询
+    inotify不可用（非Linux、监听数超过系统上限等）时，按interval比较文件的stat指纹
+PS:
+    1. 同一时间窗口（delay）内的事件会合并成一次回调，编辑器"写临时文件再rename"的保存方式只会触发一次
+    2. loop=True时递归监听子目录，新建的子目录会自动加入监听
+"""
+
+import os
+import sys
+import time
+import stat
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from . import loader
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")  # inotify_event结构体：wd, mask, cookie, len
+
+
+class Inotify(object):
+    """通过ctypes调用libc的inotify接口"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify not supported")
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    # 监听目录，返回监听描述符
+    def addWatch(self, path):
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    # 取消监听
+    def rmWatch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    # 读取已就绪的事件，返回[(wd, mask, name)]
+    def read(self):
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return events
+            raise
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if not isinstance(name, str):
+                name = name.decode(sys.getfilesystemencoding())
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PluginWatcher(object):
+    """插件目录监听器。目录有变化时，在后台线程中批量回调callback(changes)
+    changes示例：{"dirA": set(["dirA/00_func.py"])}，key为watch时传入的插件目录，
+    value为变化的文件，为空集合时表示无法确定具体文件（如事件队列溢出），需要重新查找整个目录
+    """
+
+    def __init__(self, callback, delay=0.05, interval=1, logger=logging):
+        self.callback = callback
+        self.delay = delay  # 事件合并的时间窗口（秒）
+        self.interval = interval  # 轮询间隔（秒）
+        self.logger = logger
+        self.roots = {}  # 监听的插件目录。示例：{"dirA": False, "dirB": True}
+        self.wds = {}  # inotify监听描述符对应的目录。示例：{1: [("dirA", "dirA")], 2: [("dirB", "dirB/sub")]}
+        self.polled = {}  # 轮询的插件目录及其中文件的stat指纹。示例：{"dirA": {"dirA/00_func.py": (1, 2, 3)}}
+        self.pending = {}  # 尚未回调的变化。示例：{"dirA": set(["dirA/00_func.py"])}
+        self.firstEvent = self.lastEvent = self.lastPoll = 0
+        self.lock = threading.RLock()
+        self.thread = None
+        self.running = False
+        self.wakeup = None  # 用于stop时唤醒select的管道，start时创建
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            self.inotify = None
+            self.logger.warning("inotify unavailable, fall back to polling every %ss: %s" % (interval, e))
+
+    # 监听插件目录
+    def watch(self, pluginDir, loop=False):
+        with self.lock:
+            if pluginDir in self.roots:
+                if self.roots[pluginDir] == loop:
+                    return
+                self.unwatch(pluginDir)
+            self.roots[pluginDir] = loop
+            if self.inotify:
+                try:
+                    self.addTree(pluginDir, pluginDir, loop)
+                    return
+                except OSError as e:
+                    self.removeTree(pluginDir)
+                    self.logger.warning("inotify watch %s failed, fall back to polling: %s" % (pluginDir, e))
+            self.polled[pluginDir] = self.scan(pluginDir, loop)
+
+    # 取消监听插件目录
+    def unwatch(self, pluginDir):
+        with self.lock:
+            self.roots.pop(pluginDir, None)
+            self.polled.pop(pluginDir, None)
+            self.pending.pop(pluginDir, None)
+            self.removeTree(pluginDir)
+
+    # 同步监听的插件目录。roots示例：{"dirA": False, "dirB": True}
+    def sync(self, roots):
+        with self.lock:
+            for pluginDir in set(self.roots) - set(roots):
+                self.unwatch(pluginDir)
+            for pluginDir, loop in roots.items():
+                self.watch(pluginDir, loop)
+
+    # inotify监听目录，loop为True时递归监听子目录
+    def addTree(self, root, path, loop):
+        wd = self.inotify.addWatch(path)
+        entries = self.wds.setdefault(wd, [])
+        if (root, path) not in entries:
+            entries.append((root, path))
+        if not loop:
+            return
+        for item in os.listdir(path):
+            location = os.path.join(path, item)
+            if os.path.isdir(location):
+                self.addTree(root, location, loop)
+
+    # 取消插件目录下的所有inotify监听
+    def removeTree(self, root):
+        for wd, entries in list(self.wds.items()):
+            entries[:] = [i for i in entries if i[0] != root]
+            if not entries:
+                del self.wds[wd]
+                self.inotify.rmWatch(wd)
+
+    # 获取目录中插件文件的stat指纹，用于轮询比较
+    def scan(self, pluginDir, loop):
+        result = {}
+        try:
+            items = os.listdir(pluginDir)
+        except OSError:
+            return result
+        for item in items:
+            location = os.path.join(pluginDir, item)
+            try:
+                st = os.stat(location)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if loop:
+                    result.update(self.scan(location, loop))
+            elif loader.isPluginFile(item):
+                result[location] = loader.statKey(st)
+        return result
+
+    # 记录变化，path为None时表示需要重新查找整个目录
+    def mark(self, root, path=None):
+        now = time.time()
+        if not self.pending:
+            self.firstEvent = now
+        self.lastEvent = now
+        paths = self.pending.setdefault(root, set())
+        if path:
+            paths.add(path)
+
+    # 处理inotify事件
+    def handleEvents(self, events):
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，无法确定具体变化，所有目录都需要重新查找
+                for root in self.roots:
+                    self.mark(root)
+                continue
+            entries = self.wds.get(wd, [])
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            for root, path in list(entries):
+                location = os.path.join(path, name) if name else path
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.mark(root)
+                elif mask & IN_ISDIR:
+                    if not self.roots.get(root):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self.addTree(root, location, True)
+                        except OSError:
+                            pass  # 目录刚创建就被删除
+                    self.mark(root)
+                elif loader.isPluginFile(name):
+                    self.mark(root, location)
+
+    # 轮询所有未使用inotify的插件目录
+    def poll(self):
+        self.lastPoll = time.time()
+        for root, old in list(self.polled.items()):
+            new = self.scan(root, self.roots[root])
+            for path in set(old) | set(new):
+                if old.get(path) != new.get(path):
+                    self.mark(root, path)
+            self.polled[root] = new
+
+    # 回调已合并的变化。在锁外调用，回调中可以再调用watch/sync
+    def dispatch(self, changes):
+        try:
+            self.callback(changes)
+        except Exception as e:
+            self.logger.exception("plugin watcher callback failed: %s" % e)
+
+    # 监听线程
+    def run(self):
+        fds = [self.wakeup[0]]
+        if self.inotify:
+            fds.append(self.inotify.fd)
+        while self.running:
+            now = time.time()
+            # 有未回调的变化时，等待时间窗口内不再有新事件；否则等待下一次轮询
+            timeout = self.interval
+            if self.polled:
+                timeout = max(0, self.lastPoll + self.interval - now)
+            if self.pending:
+                timeout = min(timeout, max(0, min(self.lastEvent + self.delay, self.firstEvent + self.delay * 10) - now))
+            ready = select.select(fds, [], [], timeout)[0]
+            changes = None
+            with self.lock:
+                if self.inotify and self.inotify.fd in ready:
+                    self.handleEvents(self.inotify.read())
+                now = time.time()
+                if self.polled and now - self.lastPoll >= self.interval:
+                    self.poll()
+                if self.pending and (now - self.lastEvent >= self.delay or now - self.firstEvent >= self.delay * 10):
+                    changes, self.pending = self.pending, {}
+            if changes:
+                self.dispatch(changes)
+
+    # 启动监听线程
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.wakeup = os.pipe()
+        self.lastPoll = time.time()
+        self.thread = threading.Thread(target=self.run, name="PluginWatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # 停止监听线程并释放inotify，未启动时也会释放
+    def stop(self):
+        if self.running:
+            self.running = False
+            os.write(self.wakeup[1], b"x")
+            self.thread.join()
+            for fd in self.wakeup:
+                os.close(fd)
+            self.wakeup = None
+        with self.lock:
+            for root in list(self.roots):
+                self.unwatch(root)
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
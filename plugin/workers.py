@@ -0,0 +1,209 @@
+# -*- coding:utf-8 -*-
+
+"""
+常驻工作进程池，作为Middleware.process的执行方式
+    pool = workers.WorkerPool(mid, size=4, maxTasks=1000)
+    mid.process(executor=pool)
+    pool.close()
+工作进程从已加载插件的中间件fork出来，插件只导入一次并常驻；执行时只序列化主函数名和参数，结果通过管道返回
+PS:
+    1. 调用链快照或主函数列表变化后（例如插件重载），下一次执行前替换所有工作进程
+    2. 每个工作进程执行maxTasks个调用链后被替换，避免内存持续增长
+    3. 工作进程在执行过程中退出（例如插件崩溃）时，该主函数记为{"errCode": -1, "errMsg": "WorkerCrashed: ..."}，
+       并启动新的工作进程，不影响其他主函数
+    4. 统计及熔断器状态保存在工作进程中，不会汇总到父进程
+    5. 依赖fork，只支持类Unix系统
+"""
+
+import errno
+import select
+import logging
+import threading
+import multiprocessing
+from .metrics import timer
+from .middleware import errorResult
+
+try:
+    _context = multiprocessing.get_context("fork")
+except AttributeError:
+    _context = multiprocessing  # Python 2只有fork方式
+
+
+class WorkerCrashed(Exception):
+    """工作进程在执行调用链时退出"""
+
+
+# 工作进程主循环：接收(主函数名, 主函数参数, 插件参数, 截止时间)，返回调用链结果；收到None时退出
+def _serve(mid, snapshot, conn):
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        funcName, funcParam, pluginExecParam, deadline = task
+        mid.funcParam[funcName] = funcParam
+        mid.pluginExecParam = pluginExecParam
+        func = mid.funcList[mid.funcNameList.index(funcName)]
+        rst = mid.safeRunChain(func, deadline, snapshot)
+        try:
+            conn.send(rst)
+        except (IOError, OSError):
+            return
+        except Exception as e:
+            conn.send(errorResult(e))  # 结果无法序列化
+
+
+class Worker(object):
+    """单个工作进程"""
+
+    def __init__(self, mid, snapshot):
+        self.conn, childConn = _context.Pipe()
+        self.process = _context.Process(target=_serve, args=(mid, snapshot, childConn), name="plugin-worker")
+        self.process.daemon = True
+        self.process.start()
+        childConn.close()
+        self.tasks = 0  # 已执行的调用链数量
+        self.func = None  # 正在执行的主函数
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    # 发送调用链任务
+    def send(self, func, funcParam, pluginExecParam, deadline):
+        self.func = func
+        self.conn.send((func.__name__, funcParam, pluginExecParam, deadline))
+
+    # 通知工作进程执行完当前任务后退出
+    def retire(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.conn.close()
+
+    # 立即终止工作进程
+    def kill(self):
+        self.process.terminate()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """常驻工作进程池"""
+
+    def __init__(self, mid, size=None, maxTasks=None, logger=logging):
+        """入参：
+            mid: 中间件实例，工作进程从它fork出来
+            size: 工作进程数量，默认为CPU核数
+            maxTasks: 每个工作进程最多执行的调用链数量，None为不限制
+        """
+        self.mid = mid
+        self.size = size or multiprocessing.cpu_count()
+        self.maxTasks = maxTasks
+        self.logger = logger
+        self.workers = []  # 空闲的工作进程
+        self.retired = []  # 已通知退出、尚未回收的进程
+        self.snapshot = None  # 工作进程使用的调用链快照
+        self.funcs = None  # 工作进程中的主函数列表
+        self.lock = threading.Lock()
+
+    # 调用链快照或主函数列表变化时替换所有工作进程，并补足工作进程数量
+    def prepare(self, snapshot):
+        self.retired = [p for p in self.retired if p.is_alive()]
+        if snapshot is not self.snapshot or self.funcs != self.mid.funcList:
+            if self.workers:
+                self.logger.info("plugin generation changed, recycle %s workers" % len(self.workers))
+            self.close()
+            self.snapshot, self.funcs = snapshot, list(self.mid.funcList)
+        while len(self.workers) < self.size:
+            self.workers.append(self.spawn())
+
+    # 启动新的工作进程。持有插件重载锁，避免fork出的进程中插件处于重载的中间状态
+    def spawn(self):
+        with self.mid.lock:
+            return Worker(self.mid, self.snapshot)
+
+    # 替换工作进程
+    def replace(self, worker, kill=False):
+        if kill:
+            worker.kill()
+        else:
+            worker.retire()
+        self.retired.append(worker.process)
+        return self.spawn()
+
+    # 在工作进程中执行各主函数的调用链
+    def runChains(self, funcList, deadline=None, snapshot=None):
+        """返回：各主函数的执行结果，与Middleware.process相同"""
+        mid = self.mid
+        with self.lock:
+            self.prepare(snapshot if snapshot is not None else mid.snapshot)
+            results = {}
+            pending = list(funcList)
+            idle, busy = self.workers, []
+            while pending or busy:
+                # 空闲的工作进程领取任务
+                while pending and idle:
+                    func = pending.pop(0)
+                    if mid.guard is not None and mid.guard.expired(deadline):
+                        results[func.__name__] = mid.budgetExhausted(func)
+                        continue
+                    worker = idle.pop()
+                    try:
+                        worker.send(func, mid.funcParam.get(func.__name__, {}), mid.pluginExecParam, deadline)
+                    except (IOError, OSError) as e:
+                        results[func.__name__] = self.crashed(worker, e)
+                        idle.append(self.replace(worker, kill=True))
+                        continue
+                    busy.append(worker)
+                if not busy:
+                    continue
+                timeout = None if deadline is None else max(deadline - timer(), 0)
+                try:
+                    readable = select.select(busy, [], [], timeout)[0]
+                except (select.error, IOError, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                # 超过周期预算，终止未完成的调用链
+                if not readable:
+                    for worker in busy:
+                        results[worker.func.__name__] = mid.budgetExhausted(worker.func)
+                        idle.append(self.replace(worker, kill=True))
+                    busy = []
+                    continue
+                for worker in readable:
+                    busy.remove(worker)
+                    try:
+                        results[worker.func.__name__] = worker.conn.recv()
+                    except (EOFError, IOError, OSError) as e:
+                        results[worker.func.__name__] = self.crashed(worker, e)
+                        idle.append(self.replace(worker, kill=True))
+                        continue
+                    worker.tasks += 1
+                    if self.maxTasks and worker.tasks >= self.maxTasks:
+                        worker = self.replace(worker)
+                    idle.append(worker)
+            return results
+
+    # 工作进程退出，返回该主函数的错误结果
+    def crashed(self, worker, e):
+        worker.process.join(1)
+        error = WorkerCrashed("worker %s exited with code %s while running %s: %r" % (
+            worker.process.pid, worker.process.exitcode, worker.func.__name__, e))
+        self.logger.error("func %s failed: %s" % (worker.func.__name__, error))
+        return errorResult(error)
+
+    # 通知所有工作进程退出
+    def close(self):
+        for worker in self.workers:
+            worker.retire()
+            self.retired.append(worker.process)
+        self.workers = []
+
+    # 等待所有工作进程退出
+    def join(self, timeout=None):
+        for process in self.retired:
+            process.join(timeout)
+        self.retired = [p for p in self.retired if p.is_alive()]
@@ -0,0 +1,31 @@
+# -*- coding:utf-8 -*-
+
+"""aprocess测试使用的async def主函数，只在Python 3.7+中导入"""
+
+import asyncio
+
+active = {"now": 0, "max": 0}  # 同时执行的主函数数量
+
+
+async def slowMain(index):
+    active["now"] += 1
+    active["max"] = max(active["max"], active["now"])
+    try:
+        await asyncio.sleep(0.02)
+    finally:
+        active["now"] -= 1
+    return {"errCode": 0, "errMsg": "slow %s" % index}
+
+
+async def failing():
+    return {"errCode": 1, "errMsg": "failed"}
+
+
+def slowFuncs(count):
+    funcs = []
+    for i in range(count):
+        async def slow():
+            return await slowMain(i)
+        slow.__name__ = "slow%s" % i
+        funcs.append(slow)
+    return funcs
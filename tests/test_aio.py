@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+
+import sys
+import unittest
+from .util import PluginTestCase
+from plugin import guard, middleware
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    from . import asyncfuncs
+
+ASYNC_GATE = """import asyncio
+calls = []
+
+async def run(user):
+    await asyncio.sleep(0)
+    calls.append(user)
+    return user == "admin"
+"""
+
+AFTER = """calls = []
+
+def run():
+    calls.append(True)
+    return True
+"""
+
+
+def plain(user):
+    return {"errCode": 0, "errMsg": "hello %s" % user}
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "aprocess requires Python 3.7+")
+class AprocessTest(PluginTestCase):
+    """基于asyncio执行调用链"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.before, self.after = self.pluginDir("before"), self.pluginDir("after")
+        self.writePlugin(self.before, "00_gate", ASYNC_GATE)
+        self.writePlugin(self.after, "00_after", AFTER)
+        self.mid = middleware.Middleware()
+
+    def attach(self, func, **param):
+        self.mid.funcAppend(func)
+        self.mid.addPlugin2Func(func, pluginDir=self.before, position="before")
+        self.mid.addPlugin2Func(func, pluginDir=self.after, position="after")
+        if param:
+            self.mid.addParam2Func(func, **param)
+
+    def plugin(self, position, name):
+        return self.mid.snapshot.plugin[[f.__name__ for f in self.mid.funcList][0]][position].get(name).module
+
+    def aprocess(self, concurrency=100):
+        return asyncio.run(self.mid.aprocess(concurrency=concurrency))
+
+    def testAwaitAsyncPlugin(self):
+        self.attach(plain, user="admin")
+        self.mid.addParam2Plugin(user="admin")
+        self.assertEqual(self.aprocess(), {"plain": {"errCode": 0, "errMsg": "hello admin"}})
+        self.assertEqual(self.plugin("before", "00_gate").calls, ["admin"])
+        self.assertEqual(self.plugin("after", "00_after").calls, [True])
+
+    def testFalsyShortCircuit(self):
+        self.attach(plain, user="guest")
+        self.mid.addParam2Plugin(user="guest")
+        self.assertEqual(self.aprocess(), {"plain": None})
+        self.assertEqual(self.plugin("before", "00_gate").calls, ["guest"])
+        self.assertEqual(self.plugin("after", "00_after").calls, [])
+
+    def testErrCodeSkipsAfterPlugins(self):
+        self.attach(asyncfuncs.failing)
+        self.mid.addParam2Plugin(user="admin")
+        self.assertEqual(self.aprocess(), {"failing": {"errCode": 1, "errMsg": "failed"}})
+        self.assertEqual(self.plugin("after", "00_after").calls, [])
+
+    def testConcurrencyLimit(self):
+        self.mid.addParam2Plugin(user="admin")
+        funcs = asyncfuncs.slowFuncs(6)
+        for func in funcs:
+            self.attach(func)
+        asyncfuncs.active["max"] = 0
+        results = self.aprocess(concurrency=2)
+        self.assertEqual(sorted(results), sorted(func.__name__ for func in funcs))
+        self.assertEqual(asyncfuncs.active["max"], 2)
+        self.aprocess(concurrency=6)
+        self.assertEqual(asyncfuncs.active["max"], 6)
+
+    def testGuardBreaker(self):
+        self.writePlugin(self.before, "00_gate", "async def run():\n    raise ValueError('bad')\n")
+        gd = self.mid.guard = guard.Guard(failureThreshold=2, cooldown=60)
+        self.attach(plain, user="admin")
+        for _ in range(2):
+            self.assertEqual(self.aprocess(), {"plain": {"errCode": -1, "errMsg": "ValueError: bad"}})
+        self.assertEqual(list(gd.breakerStates().values()), ["open"])
+        # 熔断期间按openResult跳过插件
+        self.assertEqual(self.aprocess(), {"plain": {"errCode": 0, "errMsg": "hello admin"}})
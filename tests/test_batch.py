@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+
+from .util import PluginTestCase
+from plugin import middleware
+
+calls = []
+
+
+def target(x):
+    calls.append(x)
+    if x == 4:
+        raise RuntimeError("bad x")
+    return {"errCode": x % 2, "errMsg": "x %s" % x}
+
+
+class ProcessBatchTest(PluginTestCase):
+    """processBatch与逐个参数集执行process的结果一致"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        before, after = self.pluginDir("before"), self.pluginDir("after")
+        self.writePlugin(before, "00_skip", "def run(x):\n    return x % 3 != 0\n")
+        self.writePlugin(before, "01_batch", "def run(x):\n    return x != 5\n\n"
+                                             "def runBatch(items):\n    return [item['x'] != 5 for item in items]\n")
+        self.writePlugin(before, "02_raise", "def run(x):\n    if x == 7:\n        raise ValueError('bad plugin')\n"
+                                             "    return True\n")
+        self.writePlugin(after, "00_done", "def run(x):\n    return True\n")
+        self.mid = middleware.Middleware()
+        self.mid.funcAppend(target)
+        self.mid.addPlugin2Func(target, pluginDir=before, position="before")
+        self.mid.addPlugin2Func(target, pluginDir=after, position="after")
+        del calls[:]
+
+    def processEach(self, values):
+        results = []
+        for x in values:
+            self.mid.addParam2Func(target, x=x)
+            self.mid.addParam2Plugin(x=x)
+            results.append(self.mid.process(executor="thread")["target"])
+        return results
+
+    def testMatchesProcess(self):
+        values = list(range(1, 12))
+        expected = self.processEach(values)
+        self.assertEqual(expected[2], None)  # 被函数前插件中断
+        self.assertEqual(expected[3], {"errCode": -1, "errMsg": "RuntimeError: bad x"})
+        self.assertEqual(expected[6], {"errCode": -1, "errMsg": "ValueError: bad plugin"})
+        del calls[:]
+        for chunkSize in (1, 4, 100):
+            rsts = list(self.mid.processBatch(target, [{"x": x} for x in values], chunkSize=chunkSize))
+            self.assertEqual(rsts, expected)
+        # 被中断的参数集不执行主函数
+        self.assertEqual(sorted(set(calls)), [1, 2, 4, 8, 10, 11])
+
+    def testExecuteBatchMatchesProcessBatch(self):
+        items = [{"x": x} for x in range(1, 12)]
+        self.mid.refresh()  # executeBatch不加载插件
+        self.assertEqual(self.mid.executeBatch("target", items), list(self.mid.processBatch("target", items)))
+
+    def testUnknownFunc(self):
+        with self.assertRaises(ValueError):
+            list(self.mid.processBatch("missing", [{"x": 1}]))
@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+from plugin import middleware
+
+
+def target(a, b, c=1, d=None):
+    return a, b, c, d
+
+
+class BinderTest(unittest.TestCase):
+    """参数绑定及错误信息"""
+
+    def testBind(self):
+        binder = middleware.Binder(target)
+        self.assertEqual(binder({"a": 1, "b": 2, "d": 4, "x": 5}), (1, 2, 1, 4))
+        # 有默认值的参数只有参数集中是真值时才覆盖
+        self.assertEqual(binder({"a": 1, "b": 2, "c": 0}), (1, 2, 1, None))
+
+    def testMissingParam(self):
+        binder = middleware.Binder(target)
+        with self.assertRaises(ValueError) as ctx:
+            binder({"a": 1})
+        self.assertEqual(str(ctx.exception), "func target('a', 'b', 'c', 'd') param b not provide")
+
+    def testSignatureFromManifest(self):
+        binder = middleware.Binder(target, signature=(["a", "b", "c", "d"], 2))
+        self.assertEqual(binder({"a": 1, "b": 2}), (1, 2, 1, None))
+        with self.assertRaises(ValueError):
+            binder({})
+
+    def testNoArgs(self):
+        self.assertEqual(middleware.Binder(lambda: 3)({}), 3)
+
+    def testCallFuncUsesFuncParam(self):
+        mid = middleware.Middleware()
+        mid.funcAppend(target)
+        mid.addParam2Func(target, a=1, b=2)
+        self.assertEqual(mid.callFunc(target), (1, 2, 1, None))
+        mid.funcParam["target"] = {"a": 1}
+        with self.assertRaises(ValueError) as ctx:
+            mid.callFunc(target)
+        self.assertIn("param b not provide", str(ctx.exception))
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+
+import time
+import unittest
+from .util import Clock, PluginTestCase
+from plugin import guard, metrics, middleware
+from plugin.modules import moduleKey
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.timer, guard.timer = guard.timer, self.clock
+        self.breaker = guard.CircuitBreaker("00_a", failureThreshold=3, cooldown=10)
+
+    def tearDown(self):
+        guard.timer = self.timer
+
+    def testOpensAfterConsecutiveFailures(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()  # 成功后重新计数
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, guard.CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def testHalfOpenProbe(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.clock.now += 9
+        self.assertFalse(self.breaker.allow())
+        # 冷却后只放行一次试探
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, guard.CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        # 试探失败继续熔断
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, guard.CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        # 试探成功恢复
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, guard.CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+
+class CallWithTimeoutTest(unittest.TestCase):
+
+    def testResultAndError(self):
+        self.assertEqual(guard.callWithTimeout(lambda x: x + 1, (1,), 1, "a"), 2)
+        with self.assertRaises(ZeroDivisionError):
+            guard.callWithTimeout(lambda: 1 / 0, (), 1, "a")
+
+    def testTimeout(self):
+        start = time.time()
+        with self.assertRaises(guard.PluginTimeout):
+            guard.callWithTimeout(time.sleep, (1,), 0.05, "a")
+        self.assertLess(time.time() - start, 0.5)
+        with self.assertRaises(guard.PluginTimeout):
+            guard.callWithTimeout(time.sleep, (0,), 0, "a")
+
+
+def target():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+def other():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+class GuardedProcessTest(PluginTestCase):
+    """执行保护下的调用链"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dir = self.pluginDir("plugins")
+        self.slow = self.writePlugin(self.dir, "00_slow", "import time\n\ndef run():\n    time.sleep(0.3)\n    return True\n")
+
+    def middleware(self, **kwargs):
+        self.guard = guard.Guard(**kwargs)
+        mid = middleware.Middleware(guard=self.guard)
+        mid.funcAppend(target)
+        mid.addPlugin2Func(target, pluginDir=self.dir, position="before")
+        return mid
+
+    def testPluginTimeoutInterruptsThenBreakerSkips(self):
+        mid = self.middleware(pluginTimeout=0.02, failureThreshold=2, cooldown=60)
+        # 超时按timeoutResult中断调用链
+        self.assertEqual(mid.process(), {"target": None})
+        self.assertEqual(mid.process(), {"target": None})
+        self.assertEqual(self.guard.breakerStates(), {moduleKey("00_slow", self.slow): "open"})
+        # 熔断期间按openResult跳过插件
+        start = time.time()
+        self.assertEqual(mid.process(), {"target": {"errCode": 0, "errMsg": "success"}})
+        self.assertLess(time.time() - start, 0.2)
+
+    def testPerPluginTimeout(self):
+        mid = self.middleware(pluginTimeout=0.02, pluginTimeouts={"00_slow": 2})
+        self.assertEqual(mid.process(), {"target": {"errCode": 0, "errMsg": "success"}})
+
+    def testCycleBudget(self):
+        mid = self.middleware(cycleBudget=0.05)
+        mid.funcAppend(other)
+        mid.addPlugin2Func(other, pluginDir=self.dir, position="before")
+        start = time.time()
+        # 第一个调用链的插件在预算用完时超时，剩余的调用链不再执行
+        self.assertEqual(mid.process(), {
+            "target": None,
+            "other": {"errCode": -1, "errMsg": "PluginTimeout: cycle budget exhausted"},
+        })
+        self.assertLess(time.time() - start, 0.2)
+
+    def testSameNamedPluginsBreakSeparately(self):
+        self.guard = guard.Guard(failureThreshold=2, cooldown=60)
+        mt = metrics.Metrics()
+        mid = middleware.Middleware(guard=self.guard, metrics=mt)
+        failing, passing = self.pluginDir("a"), self.pluginDir("b")
+        failingPath = self.writePlugin(failing, "00_check", "def run():\n    raise ValueError('bad')\n")
+        passingPath = self.writePlugin(passing, "00_check", "def run():\n    return True\n")
+        for func, pluginDir in ((target, failing), (other, passing)):
+            mid.funcAppend(func)
+            mid.addPlugin2Func(func, pluginDir=pluginDir, position="before")
+        for _ in range(3):
+            mid.process(executor="thread", maxWorkers=1)
+        failingKey, passingKey = moduleKey("00_check", failingPath), moduleKey("00_check", passingPath)
+        self.assertEqual(self.guard.breakerStates(), {failingKey: "open", passingKey: "closed"})
+        # 熔断后跳过a中的插件，b中的插件照常执行
+        stats = mt.snapshot()["plugin"]
+        self.assertEqual((stats[failingKey]["calls"], stats[failingKey]["errors"]), (2, 2))
+        self.assertEqual((stats[passingKey]["calls"], stats[passingKey]["errors"]), (3, 0))
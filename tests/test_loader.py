@@ -0,0 +1,282 @@
+# -*- coding:utf-8 -*-
+
+import gc
+import os
+import shutil
+import sys
+import weakref
+from .util import PluginTestCase
+from plugin import loader, middleware
+
+OK = "def run():\n    return True\n"
+
+
+class LoadPluginsTest(PluginTestCase):
+    """增量加载"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dir = self.pluginDir("plugins")
+        self.loader = loader.PluginLoader(pluginDir=self.dir)
+
+    def testIncrementalReload(self):
+        self.writePlugin(self.dir, "00_a", OK)
+        self.writePlugin(self.dir, "10_b", OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(sorted(plugins.names), ["00_a", "10_b"])
+        self.assertEqual(plugins.generation, 1)
+        a, b = plugins.get("00_a"), plugins.get("10_b")
+        # 无变化时不重新导入，代数不变
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.generation, 1)
+        self.assertIs(plugins.get("00_a"), a)
+        # 只重新导入有变化的插件
+        self.writePlugin(self.dir, "10_b", "VALUE = 2\n" + OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.generation, 2)
+        self.assertIs(plugins.get("00_a"), a)
+        self.assertIsNot(plugins.get("10_b"), b)
+        self.assertEqual(plugins.get("10_b").module.VALUE, 2)
+        # 变化后是新的模块对象，旧模块保持不变
+        self.assertFalse(hasattr(b.module, "VALUE"))
+        # 删除的插件随之移除
+        self.removePlugin(self.dir, "00_a")
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.names, ["10_b"])
+        self.assertEqual(plugins.generation, 3)
+
+    def testBrokenPluginNotReimported(self):
+        self.writePlugin(self.dir, "00_a", OK)
+        self.writePlugin(self.dir, "10_broken", "import no_such_module_xyz\n" + OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.names, ["00_a"])
+        generation = plugins.generation
+        imports = []
+        importPlugin = self.loader.importPlugin
+        self.loader.importPlugin = lambda record: imports.append(record.name) or importPlugin(record)
+        for _ in range(3):
+            plugins = self.loader.loadPlugins()
+        self.assertEqual(imports, [])
+        self.assertEqual(plugins.generation, generation)
+        # 修复后重新导入
+        self.writePlugin(self.dir, "10_broken", OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(sorted(plugins.names), ["00_a", "10_broken"])
+        self.assertEqual(plugins.generation, generation + 1)
+
+    def testBrokenPluginKeepsWorkingVersion(self):
+        self.writePlugin(self.dir, "00_a", OK)
+        good = self.loader.loadPlugins().get("00_a")
+        for source in ("import no_such_module_xyz\n" + OK, "def run(a)\n    return True\n"):
+            self.writePlugin(self.dir, "00_a", source)
+            plugins = self.loader.loadPlugins()
+            # 导入失败时继续使用上一版本，代数不变，模块仍在sys.modules中
+            self.assertIs(plugins.get("00_a"), good)
+            self.assertEqual(plugins.generation, 1)
+            self.assertIs(sys.modules[good.module.__name__], good.module)
+            self.assertIs(self.loader.loadPlugins().get("00_a"), good)
+        # 修复后使用新版本
+        self.writePlugin(self.dir, "00_a", "VALUE = 2\n" + OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.get("00_a").module.VALUE, 2)
+        self.assertEqual(plugins.generation, 2)
+
+    def testSyntaxErrorSkipsOnlyThatPlugin(self):
+        self.writePlugin(self.dir, "00_a", OK)
+        self.writePlugin(self.dir, "10_syntax", "def run(a)\n    return True\n")
+        self.writePlugin(self.dir, "20_raise", "raise RuntimeError('boom')\n" + OK)
+        plugins = self.loader.loadPlugins()
+        self.assertEqual(plugins.names, ["00_a"])
+        self.assertEqual(sorted(self.loader.failed), [os.path.join(self.dir, "10_syntax.py"),
+                                                      os.path.join(self.dir, "20_raise.py")])
+        ok, record = self.loader.loadPlugin(moduleName="10_syntax")
+        self.assertFalse(ok)
+
+
+# 深度优先、目录内按os.listdir顺序遍历，同名插件只保留先找到的
+def listdirOrder(pluginDir, loop, found=None):
+    found = [] if found is None else found
+    for item in os.listdir(pluginDir):
+        location = os.path.join(pluginDir, item)
+        moduleName, suffix = os.path.splitext(item)
+        if os.path.isdir(location):
+            if loop:
+                listdirOrder(location, loop, found)
+        elif suffix in (".py", ".pyc") and moduleName != "__init__" and moduleName not in [i[0] for i in found]:
+            found.append((moduleName, location))
+    return found
+
+
+class FindPluginsOrderTest(PluginTestCase):
+    """并行查找的结果与逐个目录深度优先遍历的顺序一致"""
+
+    def testSameOrderAsListdir(self):
+        root = self.pluginDir("tree")
+        for i in range(6):
+            self.writePlugin(root, "%02d_top" % i, OK)
+            for j in range(4):
+                sub = self.pluginDir("tree", "d%s" % i, "s%s" % j)
+                self.writePlugin(sub, "%02d_%s_%s" % (j, i, j), OK)
+                self.writePlugin(sub, "shared", OK)  # 同名插件只保留先找到的
+                self.writePlugin(sub, "__init__", "")
+            self.writePlugin(self.pluginDir("tree", "d%s" % i), "%02d_top" % (i + 3), OK)
+        workers, loader.SCAN_WORKERS = loader.SCAN_WORKERS, 8
+        try:
+            for loop in (True, False):
+                for _ in range(3):
+                    found = loader.PluginLoader().findPlugins(pluginDir=root, loop=loop)
+                    self.assertEqual([(i["name"], i["path"]) for i in found], listdirOrder(root, loop))
+        finally:
+            loader.SCAN_WORKERS = workers
+        self.assertEqual(len(listdirOrder(root, True)), 9 + 24 + 1)
+
+
+class FingerprintTest(PluginTestCase):
+    """stat指纹未变化时不读取文件内容"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.reads = []
+        loader.open = self.open
+        self.addCleanup(delattr, loader, "open")
+
+    # 记录loader模块中读取的文件
+    def open(self, path, *args):
+        self.reads.append(os.path.basename(path))
+        return open(path, *args)
+
+    def testUnchangedPassReadsNothing(self):
+        pluginDir = self.pluginDir("plugins")
+        for i in range(5):
+            self.writePlugin(self.pluginDir("plugins", "sub%s" % i), "%02d_a" % i, OK)
+        loaderObj = loader.PluginLoader()
+        first = loaderObj.findPlugins(pluginDir=pluginDir, loop=True)
+        self.assertEqual(len(self.reads), 5)
+        del self.reads[:]
+        self.assertEqual(loaderObj.findPlugins(pluginDir=pluginDir, loop=True), first)
+        self.assertEqual(self.reads, [])
+        # 只重新读取stat变化的文件
+        self.writePlugin(self.pluginDir("plugins", "sub3"), "03_a", "VALUE = 1\n" + OK)
+        loaderObj.findPlugins(pluginDir=pluginDir, loop=True)
+        self.assertEqual(self.reads, ["03_a.py"])
+
+    def testDirectoryMd5HashesPluginFiles(self):
+        pluginDir = self.pluginDir("plugins")
+        empty = loader.md5Sum(pluginDir)
+        self.writePlugin(self.pluginDir("plugins", "sub"), "00_a", OK)
+        first = loader.md5Sum(pluginDir)
+        self.assertNotEqual(first, empty)
+        self.assertEqual(loader.md5Sum(pluginDir), first)
+        # 非插件文件不计入
+        with open(os.path.join(pluginDir, "notes.txt"), "w") as fd:
+            fd.write("notes")
+        self.assertEqual(loader.md5Sum(pluginDir), first)
+        self.writePlugin(self.pluginDir("plugins", "sub"), "00_a", "VALUE = 1\n" + OK)
+        self.assertNotEqual(loader.md5Sum(pluginDir), first)
+
+
+class ModuleReleaseTest(PluginTestCase):
+    """旧模块随插件记录释放"""
+
+    def testOldModuleReleased(self):
+        pluginDir = self.pluginDir("plugins")
+        loaderObj = loader.PluginLoader(pluginDir=pluginDir)
+        self.writePlugin(pluginDir, "00_a", "VALUE = 1\n\ndef value():\n    return VALUE\n\n" + OK)
+        loaderObj.loadPlugins()
+        record = loaderObj.plugins.get("00_a")
+        value, record = record.module.value, weakref.ref(record)
+        self.writePlugin(pluginDir, "00_a", "VALUE = 2\n" + OK)
+        loaderObj.loadPlugins()
+        gc.collect()
+        self.assertIsNone(record())
+        self.assertEqual(loaderObj.modules.stats()["released"], 1)
+        # Python 3中仍被持有的旧函数可以继续访问其全局变量（Python 2释放模块时清空模块字典）
+        if sys.version_info[0] >= 3:
+            self.assertEqual(value(), 1)
+
+
+def target():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+def main(user):
+    return {"errCode": 0, "errMsg": "main %s" % user}
+
+
+class BrokenPluginMiddlewareTest(PluginTestCase):
+    """插件有语法错误时继续使用上一版本，其他目录照常重载"""
+
+    def testBrokenGateKeepsBlocking(self):
+        pluginDir = self.pluginDir("gate")
+        self.writePlugin(pluginDir, "00_gate", "def run(user):\n    return user == 'admin'\n")
+        mid = middleware.Middleware()
+        mid.funcAppend(main)
+        mid.addPlugin2Func(main, pluginDir=pluginDir, position="before")
+        mid.addParam2Func(main, user="guest")
+        mid.addParam2Plugin(user="guest")
+        self.assertEqual(mid.process(), {"main": None})
+        self.writePlugin(pluginDir, "00_gate", "def run(user)\n    return True\n")
+        self.assertEqual(mid.process(), {"main": None})
+        self.assertEqual(mid.funcCallChain(main), ["00_gate", "main"])
+
+    def testOtherDirectoriesReload(self):
+        broken, good = self.pluginDir("broken"), self.pluginDir("good")
+        self.writePlugin(broken, "00_ok", OK)
+        self.writePlugin(good, "00_check", "def run():\n    return True\n")
+        mid = middleware.Middleware()
+        mid.funcAppend(target)
+        mid.addPlugin2Func(target, pluginDir=broken, position="before")
+        mid.addPlugin2Func(target, pluginDir=good, position="after")
+        self.assertEqual(mid.funcCallChain(target), ["00_ok", "target", "00_check"])
+        self.writePlugin(broken, "10_syntax", "def run(a)\n    return True\n")
+        self.writePlugin(good, "00_check", "def run():\n    return False\n")
+        self.writePlugin(good, "10_new", OK)
+        chain = mid.funcCallChain(target)
+        self.assertEqual(chain[:2], ["00_ok", "target"])
+        self.assertEqual(sorted(chain[2:]), ["00_check", "10_new"])
+        self.assertFalse(mid.snapshot.plugin["target"]["after"].get("00_check").module.run())
+
+    def testRemovedDirectoryDoesNotPinOthers(self):
+        first, second = self.pluginDir("first"), self.pluginDir("second")
+        self.writePlugin(first, "00_a", OK)
+        self.writePlugin(second, "00_b", OK)
+        mid = middleware.Middleware()
+        mid.funcAppend(target)
+        mid.addPlugin2Func(target, pluginDir=first, position="before")
+        mid.addPlugin2Func(target, pluginDir=second, position="after")
+        self.assertEqual(mid.funcCallChain(target), ["00_a", "target", "00_b"])
+        # 已删除的目录视为没有插件，其他目录照常更新
+        shutil.rmtree(first)
+        self.writePlugin(second, "10_c", OK)
+        chain = mid.funcCallChain(target)
+        self.assertEqual(chain[0], "target")
+        self.assertEqual(sorted(chain[1:]), ["00_b", "10_c"])
+        self.assertIsNone(mid.reloadError)
+        # 目录重新创建后重新加载
+        os.makedirs(first)
+        self.writePlugin(first, "00_a", OK)
+        self.assertEqual(mid.funcCallChain(target)[:2], ["00_a", "target"])
+
+    def testFailedDirectoryKeepsItsPlugins(self):
+        first, second = self.pluginDir("first"), self.pluginDir("second")
+        self.writePlugin(first, "00_a", OK)
+        self.writePlugin(second, "00_b", OK)
+        mid = middleware.Middleware()
+        mid.funcAppend(target)
+        mid.addPlugin2Func(target, pluginDir=first, position="before")
+        mid.addPlugin2Func(target, pluginDir=second, position="after")
+        mid.funcCallChain(target)
+        firstLoader = [l for key, l in mid.loaders.items() if key[0] == first][0]
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("disk error")
+        firstLoader.loadPlugins = fail
+        self.writePlugin(first, "10_x", OK)
+        self.writePlugin(second, "10_c", OK)
+        chain = mid.funcCallChain(target)
+        self.assertEqual(chain[:2], ["00_a", "target"])
+        self.assertEqual(sorted(chain[2:]), ["00_b", "10_c"])
+        self.assertEqual(list(mid.loadErrors), [first])
+        del firstLoader.loadPlugins
+        self.assertEqual(sorted(mid.funcCallChain(target)[:2]), ["00_a", "10_x"])
+        self.assertEqual(mid.loadErrors, {})
@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+
+import os
+import json
+from .util import PluginTestCase
+from plugin import loader
+
+OK = "def run(task, taskPolicy=None):\n    return True\n"
+
+
+class ManifestTest(PluginTestCase):
+    """查找结果清单"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dir = self.pluginDir("plugins")
+        self.manifest = os.path.join(self.root, "manifest.json")
+        self.writePlugin(self.dir, "00_a", OK)
+        self.writePlugin(self.pluginDir("plugins", "sub"), "10_b", OK)
+        self.calls = {}
+        self.reads = []  # 读取内容的插件文件
+        for name in ("scanDir", "runSignature"):
+            self.count(name)
+        loader.open = self.open
+        self.addCleanup(delattr, loader, "open")
+
+    # 记录loader模块中读取的插件文件
+    def open(self, path, *args):
+        if path.endswith(".py"):
+            self.reads.append(os.path.basename(path))
+        return open(path, *args)
+
+    # 统计loader模块中函数的调用次数
+    def count(self, name):
+        original = getattr(loader, name)
+
+        def wrapper(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return original(*args, **kwargs)
+        setattr(loader, name, wrapper)
+        self.addCleanup(setattr, loader, name, original)
+
+    def load(self, loop=True, pluginDir=None):
+        self.calls.clear()
+        del self.reads[:]
+        loaderObj = loader.PluginLoader(manifest=self.manifest)
+        plugins = loaderObj.loadPlugins(pluginDir=pluginDir or self.dir, loop=loop)
+        return loaderObj, sorted(plugins.names)
+
+    def testWarmStart(self):
+        _, names = self.load()
+        self.assertEqual(names, ["00_a", "10_b"])
+        self.assertTrue(self.calls["scanDir"] and self.calls["runSignature"])
+        self.assertEqual(sorted(self.reads), ["00_a.py", "10_b.py"])
+        loaderObj, names = self.load()
+        self.assertEqual(names, ["00_a", "10_b"])
+        # 清单有效时只stat校验，不遍历目录、不计算md5、不解析签名
+        self.assertEqual((self.calls, self.reads), ({}, []))
+        self.assertEqual(loaderObj.plugins.get("10_b").signature, (["task", "taskPolicy"], 1))
+
+    def testNewFileInSubdirectory(self):
+        self.load()
+        self.writePlugin(self.pluginDir("plugins", "sub"), "20_c", OK)
+        loaderObj, names = self.load()
+        self.assertEqual(names, ["00_a", "10_b", "20_c"])
+        # 未变化的文件复用清单中的md5和签名
+        self.assertEqual(self.reads, ["20_c.py"])
+        self.assertEqual(self.calls["runSignature"], 1)
+        # 新的清单再次有效
+        self.assertEqual(self.load()[1], names)
+        self.assertEqual((self.calls, self.reads), ({}, []))
+
+    def testCorruptManifestRewritten(self):
+        with open(self.manifest, "w") as fd:
+            fd.write("{not json")
+        _, names = self.load()
+        self.assertEqual(names, ["00_a", "10_b"])
+        self.assertTrue(self.calls["scanDir"])
+        with open(self.manifest) as fd:
+            self.assertEqual(json.load(fd)["version"], loader.MANIFEST_VERSION)
+        self.load()
+        self.assertEqual(self.calls, {})
+
+    def testVersionMismatchIgnored(self):
+        self.load()
+        with open(self.manifest) as fd:
+            data = json.load(fd)
+        data["version"] = loader.MANIFEST_VERSION + 1
+        with open(self.manifest, "w") as fd:
+            json.dump(data, fd)
+        _, names = self.load()
+        self.assertEqual(names, ["00_a", "10_b"])
+        self.assertTrue(self.calls["scanDir"])
+        self.assertEqual(sorted(self.reads), ["00_a.py", "10_b.py"])
+
+    def testLoopOrDirectoryMismatchIgnored(self):
+        self.load()
+        _, names = self.load(loop=False)
+        self.assertEqual(names, ["00_a"])
+        self.assertTrue(self.calls["scanDir"])
+        # 清单对应的目录不同
+        other = self.pluginDir("other")
+        self.writePlugin(other, "30_d", OK)
+        _, names = self.load(loop=False, pluginDir=other)
+        self.assertEqual(names, ["30_d"])
+        self.assertTrue(self.calls["scanDir"])
@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+
+import logging
+import unittest
+from .util import Clock, PluginTestCase
+from plugin import memo, middleware
+from plugin.middleware import Binder
+
+
+class PluginCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.timer, memo.timer = memo.timer, self.clock
+
+    def tearDown(self):
+        memo.timer = self.timer
+
+    def testTtl(self):
+        cache = memo.PluginCache("00_a", ["task"], ttl=10)
+        key = cache.key({"task": 1, "other": 2})
+        self.assertEqual(key, (1,))
+        self.assertEqual(cache.get(key), (False, None))
+        cache.set(key, True)
+        self.clock.now += 9
+        self.assertEqual(cache.get(key), (True, True))
+        self.clock.now += 1
+        self.assertEqual(cache.get(key), (False, None))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "size": 0, "maxSize": memo.MAX_SIZE, "ttl": 10})
+
+    def testLru(self):
+        cache = memo.PluginCache("00_a", ["task"], maxSize=2)
+        cache.set((1,), "a")
+        cache.set((2,), "b")
+        cache.get((1,))  # 1最近使用，淘汰2
+        cache.set((3,), "c")
+        self.assertEqual(cache.get((1,)), (True, "a"))
+        self.assertEqual(cache.get((2,)), (False, None))
+        self.assertEqual(cache.get((3,)), (True, "c"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def testUnhashableNotCached(self):
+        cache = memo.PluginCache("00_a", ["task"])
+        key = cache.key({"task": {"id": 1}})
+        self.assertIsNone(key)
+        cache.set(key, True)
+        self.assertEqual(cache.get(key), (False, None))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def testFromPlugin(self):
+        def run(task, taskPolicy=None):
+            return True
+        binder = Binder(run)
+        self.assertIsNone(memo.fromPlugin(run, binder, logging))
+        for config, keys, maxSize, ttl in ((True, ("task", "taskPolicy"), memo.MAX_SIZE, None),
+                                           ({"keys": ["task"], "maxSize": 4, "ttl": 1}, ("task",), 4, 1.0)):
+            run.__globals__["CACHE"] = config
+            try:
+                cache = memo.fromPlugin(run, binder, logging)
+            finally:
+                del run.__globals__["CACHE"]
+            self.assertEqual((cache.keys, cache.maxSize, cache.ttl), (keys, maxSize, ttl))
+
+
+CACHED = """CACHE = {"keys": ["task"]}
+calls = []
+
+def run(task):
+    calls.append(task)
+    return True
+"""
+
+
+def target():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+class CachedPluginTest(PluginTestCase):
+    """中间件中的插件结果缓存"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dirs = self.pluginDir("a"), self.pluginDir("b")
+        self.mid = middleware.Middleware()
+        self.mid.funcAppend(target)
+        for pluginDir, position in zip(self.dirs, ("before", "after")):
+            self.writePlugin(pluginDir, "00_cached", CACHED)
+            self.mid.addPlugin2Func(target, pluginDir=pluginDir, position=position)
+
+    def testCachedResultsPerDirectory(self):
+        for task in (1, 1, 0, 0):
+            self.mid.addParam2Plugin(task=task)
+            self.mid.process()
+        for position in ("before", "after"):
+            module = self.mid.snapshot.plugin["target"][position].get("00_cached").module
+            self.assertEqual(module.calls, [1, 0])
+        # 不同目录中的同名插件分别统计
+        stats = self.mid.cacheStats()
+        self.assertEqual(len(stats), 2)
+        for key, stat in stats.items():
+            self.assertTrue(key.endswith("_00_cached"))
+            self.assertEqual((stat["hits"], stat["misses"], stat["size"]), (2, 2, 2))
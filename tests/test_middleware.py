@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+
+from .util import PluginTestCase
+from plugin import middleware
+
+imports = []  # 插件模块被导入的次数
+
+SOURCE = "from tests.test_middleware import imports\nimports.append(__name__)\n%s\ndef run():\n    return True\n"
+
+
+def funcA():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+def funcB():
+    return {"errCode": 0, "errMsg": "success"}
+
+
+class SharedLoaderTest(PluginTestCase):
+    """同一插件目录挂载到多个函数或位置时共用加载器"""
+
+    def testImportedOncePerChange(self):
+        pluginDir = self.pluginDir("plugins")
+        self.writePlugin(pluginDir, "00_a", SOURCE % "")
+        mid = middleware.Middleware()
+        for func in (funcA, funcB):
+            mid.funcAppend(func)
+            for position in ("before", "after"):
+                mid.addPlugin2Func(func, pluginDir=pluginDir, position=position)
+        del imports[:]
+        self.assertEqual(mid.funcCallChain(funcA), ["00_a", "funcA", "00_a"])
+        self.assertEqual(mid.funcCallChain(funcB), ["00_a", "funcB", "00_a"])
+        self.assertEqual(len(imports), 1)
+        self.assertEqual(len(mid.loaders), 1)
+        records = set(id(mid.snapshot.plugin[func][position].get("00_a"))
+                      for func in ("funcA", "funcB") for position in ("before", "after"))
+        self.assertEqual(len(records), 1)
+        mid.process()
+        self.assertEqual(len(imports), 1)
+        # 插件变化后只重新导入一次
+        self.writePlugin(pluginDir, "00_a", SOURCE % "VALUE = 2")
+        mid.process()
+        self.assertEqual(len(imports), 2)
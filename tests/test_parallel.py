@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+from .util import PluginTestCase
+from plugin import middleware
+
+events = []
+
+
+def target():
+    events.append("target")
+    return {"errCode": 0, "errMsg": "success"}
+
+
+def plugin(name, meta=""):
+    return "from tests.test_parallel import events\n%s\ndef run():\n    events.append(%r)\n    return True\n" % (
+        meta, name)
+
+
+class ParallelTest(PluginTestCase):
+    """按阶段执行插件"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dir = self.pluginDir("plugins")
+        for name, meta in (("20_c", "PRIORITY = 2\n"), ("00_a", "PRIORITY = 1\n"), ("10_b", "PRIORITY = 2\n")):
+            self.writePlugin(self.dir, name, plugin(name, meta))
+        del events[:]
+
+    def middleware(self, **kwargs):
+        mid = middleware.Middleware(parallel=True, **kwargs)
+        mid.funcAppend(target)
+        mid.addPlugin2Func(target, pluginDir=self.dir, position="before")
+        return mid
+
+    def testStageOrder(self):
+        mid = self.middleware()
+        chain = mid.funcCallChain(target)
+        self.assertEqual((chain[0], sorted(chain[1:3]), chain[3]), ("00_a", ["10_b", "20_c"], "target"))
+        self.assertEqual([[p.name for p in stage] for stage in mid.pluginStages(mid.snapshot.plugin["target"]["before"])],
+                         [["00_a"], chain[1:3]])
+        self.assertEqual(mid.process(), {"target": {"errCode": 0, "errMsg": "success"}})
+        self.assertEqual((events[0], sorted(events[1:3]), events[3]), ("00_a", ["10_b", "20_c"], "target"))
+
+    def testInvalidPriorityDoesNotBreakChain(self):
+        self.writePlugin(self.dir, "30_bad", plugin("30_bad", "PRIORITY = 'high'\n"))
+        mid = self.middleware()
+        self.assertEqual(sorted(mid.funcCallChain(target)), ["00_a", "10_b", "20_c", "30_bad", "target"])
+        self.assertEqual(mid.process(), {"target": {"errCode": 0, "errMsg": "success"}})
+        self.assertEqual(sorted(events), ["00_a", "10_b", "20_c", "30_bad", "target"])
+
+    def testLazyCallChainDoesNotImport(self):
+        mid = self.middleware(lazy=True)
+        self.assertEqual(sorted(mid.funcCallChain(target)), ["00_a", "10_b", "20_c", "target"])
+        records = list(mid.snapshot.plugin["target"]["before"])
+        self.assertEqual([p._module for p in records], [None] * 3)
+        self.assertEqual(events, [])
+        # 执行时才导入并按阶段执行
+        mid.process()
+        self.assertEqual((events[0], sorted(events[1:3]), events[3]), ("00_a", ["10_b", "20_c"], "target"))
@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+import multiprocessing
+from .util import PluginTestCase
+from plugin import middleware
+
+
+def funcA(task=None):
+    return {"errCode": 0, "errMsg": "a %s" % task}
+
+
+def funcB(task=None):
+    return {"errCode": 1, "errMsg": "b %s" % task}
+
+
+def funcC():
+    raise RuntimeError("boom")
+
+
+class ProcessTest(PluginTestCase):
+    """各执行方式的结果与顺序执行一致"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        before, after = self.pluginDir("before"), self.pluginDir("after")
+        self.writePlugin(before, "00_check", "def run(task):\n    return task != 'skip'\n")
+        self.writePlugin(after, "00_done", "def run():\n    return True\n")
+        self.mid = middleware.Middleware()
+        for func in (funcA, funcB, funcC):
+            self.mid.funcAppend(func)
+            self.mid.addPlugin2Func(func, pluginDir=before, position="before")
+            self.mid.addPlugin2Func(func, pluginDir=after, position="after")
+            self.mid.addParam2Func(func, task=1)
+        self.mid.addParam2Plugin(task=1)
+
+    def expected(self):
+        return {
+            "funcA": {"errCode": 0, "errMsg": "a 1"},
+            "funcB": {"errCode": 1, "errMsg": "b 1"},
+            "funcC": {"errCode": -1, "errMsg": "RuntimeError: boom"},
+        }
+
+    def testSequential(self):
+        with self.assertRaises(RuntimeError):
+            self.mid.process()
+
+    def testThread(self):
+        self.assertEqual(self.mid.process(executor="thread"), self.expected())
+
+    def testProcess(self):
+        self.assertEqual(self.mid.process(executor="process", maxWorkers=2), self.expected())
+
+    def testShortCircuit(self):
+        self.mid.addParam2Plugin(task="skip")
+        self.assertEqual(self.mid.process(executor="thread"), {"funcA": None, "funcB": None, "funcC": None})
+
+    @unittest.skipUnless(hasattr(multiprocessing, "get_start_method"), "Python 2 only forks")
+    def testProcessUnderSpawn(self):
+        method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method("spawn", force=True)
+        try:
+            self.assertEqual(self.mid.process(executor="process", maxWorkers=2), self.expected())
+        finally:
+            multiprocessing.set_start_method(method, force=True)
@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+
+import logging
+import unittest
+from types import ModuleType
+from plugin import schedule
+
+
+class Record(object):
+    """只有名称和模块的插件记录"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.module = ModuleType(name)
+        self.module.run = lambda: True
+        for key, value in attrs.items():
+            setattr(self.module, key, value)
+
+
+class BuildStagesTest(unittest.TestCase):
+
+    def stages(self, *records):
+        return [[p.name for p in stage] for stage in schedule.buildStages(records, logging)]
+
+    def testUndeclaredKeepOrder(self):
+        # NN_前缀不影响阶段划分，都没有声明时按原有顺序逐个执行
+        self.assertEqual(self.stages(Record("20_c"), Record("00_a"), Record("10_b")), [["20_c"], ["00_a"], ["10_b"]])
+
+    def testSharedPriorityRunsTogether(self):
+        self.assertEqual(self.stages(Record("00_a", PRIORITY=2), Record("10_b", PRIORITY=1),
+                                     Record("20_c", PRIORITY=2), Record("30_d", DEPENDS=[])),
+                         [["10_b", "30_d"], ["00_a", "20_c"]])
+
+    def testDepends(self):
+        self.assertEqual(self.stages(Record("a", DEPENDS=["c"]), Record("b", DEPENDS=[]), Record("c", DEPENDS=[]),
+                                     Record("d", DEPENDS=["a", "missing"])),
+                         [["b", "c"], ["a"], ["d"]])
+
+    def testUndeclaredIsBarrier(self):
+        self.assertEqual(self.stages(Record("a", DEPENDS=[]), Record("b", DEPENDS=[]), Record("gate"),
+                                     Record("c", PRIORITY=1), Record("d", PRIORITY=1), Record("e")),
+                         [["a", "b"], ["gate"], ["c", "d"], ["e"]])
+
+    def testInvalidMetadataIgnored(self):
+        self.assertEqual(self.stages(Record("a", PRIORITY="high"), Record("b", PRIORITY=True),
+                                     Record("c", DEPENDS="a"), Record("d", PRIORITY=1.5), Record("e", PRIORITY=1)),
+                         [["a"], ["b"], ["c"], ["e"], ["d"]])
+
+    def testCycleRunsSequentially(self):
+        records = (Record("a", DEPENDS=["b"]), Record("b", DEPENDS=["a"]), Record("c", DEPENDS=[]))
+        self.assertEqual(self.stages(*records), [["a"], ["b"], ["c"]])
+        # 依赖屏障之后的插件
+        records = (Record("a", DEPENDS=["c"]), Record("gate"), Record("c", DEPENDS=[]))
+        self.assertEqual(self.stages(*records), [["a"], ["gate"], ["c"]])
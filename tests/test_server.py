@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+
+import os
+import socket
+import threading
+from .util import PluginTestCase
+from plugin import middleware, server
+
+gate = threading.Event()
+started = threading.Event()
+
+
+def echo(value):
+    started.set()
+    gate.wait(5)
+    return {"errCode": 0, "errMsg": "echo %s" % value}
+
+
+class FakeChannel(object):
+    """记录响应的通道"""
+
+    def __init__(self):
+        self.replies = []
+
+    def begin(self):
+        pass
+
+    def reply(self, jobId, result):
+        self.replies.append((jobId, result))
+
+
+class JobServerTest(PluginTestCase):
+    """常驻任务服务的反压及停止"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        pluginDir = self.pluginDir("plugins")
+        self.writePlugin(pluginDir, "00_ok", "def run():\n    return True\n")
+        mid = middleware.Middleware()
+        mid.funcAppend(echo)
+        mid.addPlugin2Func(echo, pluginDir=pluginDir, position="before")
+        self.path = os.path.join(self.root, "server.sock")
+        self.srv = server.JobServer(mid, self.path, workers=1, queueSize=1, batchSize=1, backpressure=0.05,
+                                    reloadInterval=None)
+        self.srv.start()
+        gate.clear()
+        started.clear()
+
+    def tearDown(self):
+        gate.set()
+        self.srv.shutdown(timeout=1)
+        PluginTestCase.tearDown(self)
+
+    def testBackpressure(self):
+        client = server.Client(self.path, timeout=5)
+        try:
+            results = {}
+            caller = threading.Thread(target=lambda: results.update(
+                rsts=client.callMany([("echo", {"value": i}) for i in range(4)])))
+            caller.start()
+            # 第一个任务执行中、第二个任务在队列中，其余任务等待backpressure后被拒绝
+            started.wait(5)
+            while self.srv.stats()["rejected"] < 2:
+                threading.Event().wait(0.01)
+            gate.set()
+            caller.join(5)
+        finally:
+            client.close()
+        busy = {"errCode": -1, "errMsg": "ServerBusy: job queue full"}
+        self.assertEqual(results["rsts"], [{"errCode": 0, "errMsg": "echo 0"}, {"errCode": 0, "errMsg": "echo 1"},
+                                           busy, busy])
+        stats = self.srv.stats()
+        self.assertEqual((stats["accepted"], stats["rejected"]), (2, 2))
+
+    def testShutdownFinishesAcceptedJobs(self):
+        client = server.Client(self.path, timeout=5)
+        try:
+            results = {}
+            caller = threading.Thread(target=lambda: results.update(rst=client.call("echo", {"value": 1})))
+            caller.start()
+            started.wait(5)
+            stopper = threading.Thread(target=self.srv.shutdown)
+            stopper.start()
+            # 停止后提交的任务被拒绝
+            while not self.srv.stopped.is_set():
+                threading.Event().wait(0.01)
+            channel = FakeChannel()
+            self.srv.submit(b'{"id": 7, "func": "echo", "params": {"value": 2}}', channel)
+            self.assertEqual(channel.replies, [(7, {"errCode": -1, "errMsg": "ServerStopped: server is shutting down"})])
+            gate.set()
+            caller.join(5)
+            stopper.join(5)
+        finally:
+            client.close()
+        self.assertEqual(results["rst"], {"errCode": 0, "errMsg": "echo 1"})
+        self.assertFalse(stopper.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.srv.connections, set())
+        self.assertRaises(socket.error, server.Client, self.path)
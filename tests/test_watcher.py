@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+import threading
+import unittest
+from .util import PluginTestCase
+from plugin import watcher
+
+OK = "def run():\n    return True\n"
+
+
+class WatcherTest(PluginTestCase):
+    """插件目录的新增、修改、删除事件"""
+    polling = False
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.dir = self.pluginDir("plugins")
+        self.changes = []
+        self.changed = threading.Event()
+        self.watcher = watcher.PluginWatcher(self.onChange, delay=0.02, interval=0.05)
+        if self.polling and self.watcher.inotify:
+            self.watcher.inotify.close()
+            self.watcher.inotify = None
+        self.watcher.watch(self.dir)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        PluginTestCase.tearDown(self)
+
+    def onChange(self, changes):
+        self.changes.append(changes)
+        self.changed.set()
+
+    # 等待回调，返回变化的文件
+    def waitChange(self):
+        self.assertTrue(self.changed.wait(5), "no change reported")
+        time.sleep(0.1)  # 合并同一次修改产生的多个事件
+        self.changed.clear()
+        paths = set()
+        for changes in self.changes:
+            self.assertEqual(list(changes), [self.dir])
+            paths.update(changes[self.dir])
+        del self.changes[:]
+        return paths
+
+    def testAddChangeDelete(self):
+        path = self.writePlugin(self.dir, "00_a", OK)
+        self.assertEqual(self.waitChange(), set([path]))
+        self.writePlugin(self.dir, "00_a", "VALUE = 1\n" + OK)
+        self.assertEqual(self.waitChange(), set([path]))
+        self.removePlugin(self.dir, "00_a")
+        self.assertEqual(self.waitChange(), set([path]))
+
+
+class PollingWatcherTest(WatcherTest):
+    """inotify不可用时轮询"""
+    polling = True
+
+
+class WatcherResourceTest(PluginTestCase):
+
+    @unittest.skipUnless(os.path.isdir("/proc/self/fd"), "needs /proc")
+    def testUnstartedWatcherReleasesFds(self):
+        before = len(os.listdir("/proc/self/fd"))
+        for _ in range(5):
+            watcher.PluginWatcher(lambda changes: None).stop()
+        self.assertEqual(len(os.listdir("/proc/self/fd")), before)
@@ -0,0 +1,79 @@
+# -*- coding:utf-8 -*-
+
+import os
+from .util import PluginTestCase
+from plugin import middleware, workers
+
+CRASH = """import os
+
+def run(crash=False):
+    if crash:
+        os._exit(3)
+    return True
+"""
+
+
+def crasher():
+    return {"errCode": 0, "errMsg": "crasher %s" % os.getpid()}
+
+
+def survivor():
+    return {"errCode": 0, "errMsg": "survivor %s" % os.getpid()}
+
+
+class WorkerPoolTest(PluginTestCase):
+    """常驻工作进程池"""
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.crashDir, self.okDir = self.pluginDir("crash"), self.pluginDir("ok")
+        self.writePlugin(self.crashDir, "00_crash", CRASH)
+        self.writePlugin(self.okDir, "00_ok", "def run():\n    return True\n")
+        self.mid = middleware.Middleware()
+        self.mid.funcAppend(crasher)
+        self.mid.funcAppend(survivor)
+        self.mid.addPlugin2Func(crasher, pluginDir=self.crashDir, position="before")
+        self.mid.addPlugin2Func(survivor, pluginDir=self.okDir, position="before")
+        self.pool = workers.WorkerPool(self.mid, size=2, maxTasks=3)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join(5)
+        PluginTestCase.tearDown(self)
+
+    def pids(self):
+        return set(worker.process.pid for worker in self.pool.workers)
+
+    def testCrashedWorkerReplaced(self):
+        self.assertEqual(self.mid.process(executor=self.pool)["crasher"]["errCode"], 0)
+        before = self.pids()
+        self.mid.addParam2Plugin(crash=True)
+        results = self.mid.process(executor=self.pool)
+        # 只有崩溃的主函数记为错误，其他主函数不受影响
+        self.assertEqual(results["survivor"]["errCode"], 0)
+        self.assertEqual(results["crasher"]["errCode"], -1)
+        self.assertTrue(results["crasher"]["errMsg"].startswith("WorkerCrashed: "))
+        self.assertIn("exited with code 3 while running crasher", results["crasher"]["errMsg"])
+        # 崩溃的工作进程被替换，数量不变
+        after = self.pids()
+        self.assertEqual(len(after), 2)
+        self.assertEqual(len(before & after), 1)
+        self.mid.addParam2Plugin(crash=False)
+        results = self.mid.process(executor=self.pool)
+        self.assertEqual([results[name]["errCode"] for name in ("crasher", "survivor")], [0, 0])
+
+    def testMaxTasksRecycle(self):
+        pids = set()
+        for _ in range(3):
+            results = self.mid.process(executor=self.pool)
+            pids.update(int(rst["errMsg"].split()[1]) for rst in results.values())
+        # 两个工作进程共执行6个调用链，每个执行3个后被替换
+        self.assertEqual(len(pids), 2)
+        self.assertFalse(pids & self.pids())
+
+    def testReloadRecyclesWorkers(self):
+        self.mid.process(executor=self.pool)
+        before = self.pids()
+        self.writePlugin(self.okDir, "10_new", "def run():\n    return True\n")
+        self.mid.process(executor=self.pool)
+        self.assertFalse(before & self.pids())
@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*-
+
+"""
+测试公用方法：在临时目录中生成插件
+运行：python -m unittest discover -s tests -t .（Python 3也可以直接运行pytest）
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.dont_write_bytecode = True  # 插件文件频繁改写，不生成pyc
+logging.getLogger().setLevel(logging.CRITICAL)
+
+
+class Clock(object):
+    """可手动推进的计时器"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PluginTestCase(unittest.TestCase):
+    """每个测试使用独立的临时插件目录"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="simple-plugin-test-")
+        self.clock = int(time.time()) - 1000  # 写入插件后设置的修改时间，保证每次写入的stat指纹都不同
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # 插件目录路径，不存在时创建
+    def pluginDir(self, *names):
+        path = os.path.join(self.root, *names)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path + os.sep
+
+    # 写入插件文件，返回文件路径
+    def writePlugin(self, pluginDir, name, source):
+        path = os.path.join(pluginDir, name + ".py")
+        with open(path, "w") as fd:
+            fd.write(source)
+        self.clock += 1
+        os.utime(path, (self.clock, self.clock))
+        return path
+
+    # 删除插件文件
+    def removePlugin(self, pluginDir, name):
+        os.remove(os.path.join(pluginDir, name + ".py"))